@@ -0,0 +1,488 @@
+"""
+Benchmarks for the algorithms in CatGame.py.
+
+The benchmark positions live in CatBench_positions.json, a versioned
+corpus of NxN boards, N from 5 to 21, with the cat in the center and
+blocks at several densities. `python CatBench.py corpus` writes it from
+fixed seeds. Bump CORPUS_VERSION whenever the generation changes:
+results are only comparable on the same corpus.
+
+Usage:
+    python CatBench.py corpus
+    python CatBench.py suite [--deadline T] [--repeat R] [--save FILE] [--baseline FILE] [--threshold X]
+    python CatBench.py blockers [--depth D] [--sizes N ...]
+    python CatBench.py eval [--depth D] [--sizes N ...]
+    python CatBench.py pvs [--depth D] [--sizes N ...]
+    python CatBench.py ordering [--depth D] [--sizes N ...]
+    python CatBench.py batch [--depth D] [--sizes N ...]
+    python CatBench.py symmetry [--depth D] [--sizes N ...]
+    python CatBench.py proof [--deadline T] [--sizes N ...]
+    python CatBench.py clock [--depth D] [--sizes N ...]
+
+corpus   -- Write the benchmark positions.
+suite    -- On every position: wall time and nodes of Minimax to depth 2,
+            Alpha-Beta to depth 3 and the Depth-Limited Cat to depth 4,
+            nodes per second, the time Iterative Deepening takes to finish
+            each depth within a deadline of T seconds, and the peak memory
+            of the Depth-Limited Cat, taking the best time of R runs.
+            --save writes the results as JSON,
+            --baseline compares them with saved results and exits with
+            status 1 when something got worse by more than the threshold.
+blockers -- Alpha-Beta to depth D with the blocker trying every free tile
+            (Game.full_scan) against the relevant tiles only.
+eval     -- Cost per leaf of CatEvalFn.score_proximity and score_escape,
+            and Alpha-Beta to depth D with each of them.
+pvs      -- Nodes of Iterative Deepening from depth 1 to D, with plain
+            Alpha-Beta and with Principal Variation Search and aspiration
+            windows (Game.pvs).
+ordering -- The same, without and with the killer and history move
+            ordering (Game.history_ordering).
+batch    -- The same, scoring the leaves one by one and in batches
+            (Game.batch_leaves).
+symmetry -- The same, with plain Zobrist keys and with a position and its
+            mirror image sharing their table entries (Game.symmetry).
+proof    -- Nodes and time to prove who wins, with proof-number search
+            (CatProof.py, within Game.proof_nodes) and with Iterative
+            Deepening Alpha-Beta, each stopped after T seconds.
+clock    -- Alpha-Beta to depth D reading the clock at every node and
+            every Game.poll_nodes nodes, then how often the Alpha-Beta and
+            the Iterative-Deepening Cats run out of time with short
+            deadlines: how often they fall back on Game.fallback_move
+            (they used to forfeit then), still forfeit, or answer late.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from CatBoard import EscapeMap
+from CatGame import Game
+from CatProof import prove
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CatBench_positions.json")
+CORPUS_VERSION = 1
+RESULTS_VERSION = 1
+
+SIZES = range(5, 22, 2)
+DENSITIES = (0.05, 0.10, 0.15)
+
+
+def generate_corpus():
+    """The benchmark positions, the same on every machine and Python version."""
+    positions = []
+    for size in SIZES:
+        for density in DENSITIES:
+            name = "%dx%d-%d%%" % (size, size, round(100*density))
+            rand = random.Random(name)
+            cat = [size//2, size//2]
+            cells = [[i, j] for i in range(size) for j in range(size) if [i, j] != cat]
+            blocks = sorted(rand.sample(cells, round(density * size**2)))
+            positions.append(dict(name=name, size=size, cat=cat, blocks=blocks))
+    return dict(version=CORPUS_VERSION, positions=positions)
+
+
+def load_corpus(sizes=None):
+    with open(CORPUS) as f:
+        corpus = json.load(f)
+    if corpus["version"] != CORPUS_VERSION:
+        sys.exit("%s is version %d, expected %d: run `python CatBench.py corpus`"
+                 % (CORPUS, corpus["version"], CORPUS_VERSION))
+    return [p for p in corpus["positions"] if sizes is None or p["size"] in sizes]
+
+
+def make_game(entry):
+    """A fresh game, with an empty transposition table, on a corpus position."""
+    game = Game(entry["size"])
+    game.place_cat(*entry["cat"])
+    for i, j in entry["blocks"]:
+        game.place_block(i, j)
+    return game
+
+
+def count_nodes(game):
+    """Count the nodes searched from now on, as the moves made on the game
+    and the leaves scored in batches without making them (Game.batch_leaves).
+    Returns a one-item list holding the count.
+    """
+    count = [0]
+    make_move = game.make_move
+    def counting_make_move(cell, maximizing_player):
+        count[0] += 1
+        make_move(cell, maximizing_player)
+    game.make_move = counting_make_move
+    utility_batch = game.utility_batch
+    def counting_utility_batch(boards, cats, maximizing_player=True):
+        count[0] += len(cats)
+        return utility_batch(boards, cats, maximizing_player)
+    game.utility_batch = counting_utility_batch
+    return count
+
+
+def timed(game, search, timeout=3600):
+    """Run search() on the game, quietly. Returns (result, nodes, seconds)."""
+    nodes = count_nodes(game)
+    game.reached_maxdepth = False
+    game.terminated = False
+    game.start_time = time.time()
+    game.deadline = game.start_time + timeout
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = search()
+    return result, nodes[0], time.time() - game.start_time
+
+
+def run_alphabeta(game, depth):
+    (move, value), nodes, seconds = timed(game, lambda: game.alphabeta(max_depth=depth))
+    return move, value, nodes, seconds
+
+
+def depth_times(game, deadline):
+    """Run the Iterative-Deepening Cat with a deadline of that many seconds.
+    Returns the time at which each depth was finished.
+    """
+    times = []
+    alphabeta = game.alphabeta
+    def timed_alphabeta(max_depth):
+        result = alphabeta(max_depth=max_depth)
+        if not game.terminated:
+            times.append(time.time() - game.start_time)
+        return result
+    game.alphabeta = timed_alphabeta
+    timed(game, lambda: game.IterativeDeepeningCat(ab=True), deadline)
+    return times
+
+
+def peak_memory(game, search):
+    """Peak memory allocated by search(), in KB. Tracing slows the search
+    down a lot, so this is a run of its own.
+    """
+    tracemalloc.start()
+    try:
+        timed(game, search)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+SEARCHES = (
+    ("minimax", lambda game: game.minimax(max_depth=2)),
+    ("alphabeta", lambda game: game.alphabeta(max_depth=3)),
+    ("dls", lambda game: game.DepthLimitedCat(max_depth=4, ab=True)),
+)
+
+
+def run_suite(deadline, repeat):
+    """Run the suite. Every time is the best of repeat runs, each on a
+    fresh game, which takes out most of the noise.
+    """
+    results = {}
+    print("%-10s | %9s %9s %9s | %9s | %3s %-28s | %8s" % (
+          "position", "minimax", "alphabeta", "DLS", "nodes/s", "ID", "time to depth (ms)", "peak KB"))
+    for entry in load_corpus():
+        result = {}
+        nodes = seconds = 0
+        for name, search in SEARCHES:
+            runs = [timed(game, lambda: search(game))
+                    for game in (make_game(entry) for k in range(repeat))]
+            t = min(run[2] for run in runs)
+            result[name] = dict(time=t, nodes=runs[0][1])
+            nodes += runs[0][1]
+            seconds += t
+        result["nodes_per_sec"] = nodes / seconds
+        # the best time to each depth, over the runs that got there
+        runs = [depth_times(make_game(entry), deadline) for k in range(repeat)]
+        result["id_depth_times"] = [min(run[depth] for run in runs if len(run) > depth)
+                                    for depth in range(max(map(len, runs)))]
+        game = make_game(entry)
+        result["peak_kb"] = peak_memory(game, lambda: SEARCHES[-1][1](game))
+        results[entry["name"]] = result
+
+        print("%-10s | %7.1fms %7.1fms %7.1fms | %9.0f | %3d %-28s | %8.0f" % (
+              entry["name"], 1000*result["minimax"]["time"], 1000*result["alphabeta"]["time"],
+              1000*result["dls"]["time"], result["nodes_per_sec"], len(result["id_depth_times"]),
+              " ".join("%.0f" % (1000*t) for t in result["id_depth_times"])[-28:], result["peak_kb"]))
+    return dict(version=RESULTS_VERSION, corpus=CORPUS_VERSION, deadline=deadline, positions=results)
+
+
+def compare(results, baseline, threshold, min_time):
+    """Print what got worse than in the baseline by more than threshold
+    (0.25 is 25%), and return how many of those there are. Times under
+    min_time seconds in both runs are too noisy to compare.
+    """
+    for field in ("version", "corpus", "deadline"):
+        if baseline[field] != results[field]:
+            sys.exit("The baseline has %s %s, not %s" % (field, baseline[field], results[field]))
+
+    regressions = []
+    def check(name, metric, new, old, higher_is_better=False):
+        if higher_is_better:
+            worse = new < old * (1 - threshold)
+        else:
+            worse = new > old * (1 + threshold)
+        if worse:
+            regressions.append((name, metric, old, new))
+
+    for name, new in sorted(results["positions"].items()):
+        old = baseline["positions"].get(name)
+        if old is None:
+            continue
+        for search, fn in SEARCHES:
+            if max(new[search]["time"], old[search]["time"]) >= min_time:
+                check(name, search + " time", new[search]["time"], old[search]["time"])
+            check(name, search + " nodes", new[search]["nodes"], old[search]["nodes"])
+        check(name, "nodes/s", new["nodes_per_sec"], old["nodes_per_sec"], higher_is_better=True)
+        check(name, "ID depth", len(new["id_depth_times"]), len(old["id_depth_times"]), higher_is_better=True)
+        for depth, (t_new, t_old) in enumerate(zip(new["id_depth_times"], old["id_depth_times"]), 1):
+            if max(t_new, t_old) >= min_time:
+                check(name, "ID depth %d time" % depth, t_new, t_old)
+        check(name, "peak KB", new["peak_kb"], old["peak_kb"])
+
+    print()
+    if regressions:
+        print("%d regressions past %.0f%%:" % (len(regressions), 100*threshold))
+        for name, metric, old, new in regressions:
+            print("  %-10s %-18s %12.4g -> %12.4g" % (name, metric, old, new))
+    else:
+        print("No regressions past %.0f%%" % (100*threshold))
+    return len(regressions)
+
+
+def bench_blockers(depth, positions):
+    print("Alpha-Beta to depth %d: every free tile vs. relevant tiles" % depth)
+    print("%-10s | %10s %9s %8s | %10s %9s %8s | %s" % (
+          "position", "full nodes", "time", "move", "rel. nodes", "time", "move", "same move"))
+    totals = [0, 0.0, 0, 0.0, 0]
+    for entry in positions:
+        row = []
+        for full_scan in (True, False):
+            game = make_game(entry)
+            game.full_scan = full_scan
+            row.append(run_alphabeta(game, depth))
+        (move1, value1, nodes1, time1), (move2, value2, nodes2, time2) = row
+        same = move1 == move2
+        print("%-10s | %10d %8.3fs %8s | %10d %8.3fs %8s | %s" % (
+              entry["name"], nodes1, time1, move1, nodes2, time2, move2, "yes" if same else "NO"))
+        for k, x in enumerate((nodes1, time1, nodes2, time2, same)):
+            totals[k] += x
+    print("%-10s | %10d %8.3fs %8s | %10d %8.3fs %8s | %d/%d" % (
+          "total", totals[0], totals[1], "", totals[2], totals[3], "", totals[4], len(positions)))
+
+
+def time_per_call(fn, repeat=2000):
+    """Average time of fn() in microseconds."""
+    start = time.perf_counter()
+    for k in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_eval(depth, positions):
+    print("Cost per leaf evaluation, in microseconds")
+    print("%-10s | %9s %9s %9s %12s" % (
+          "position", "proximity", "escape", "BFS", "block+undo"))
+    for entry in positions:
+        game = make_game(entry)
+        position = game.position
+        eval_fn = game.eval_fn
+        proximity = time_per_call(lambda: eval_fn.score_proximity(game))
+        position.track_escape()
+        escape = time_per_call(lambda: eval_fn.score_escape(game))
+        scratch = time_per_call(lambda: EscapeMap(position), repeat=200)
+        cells = list(position.relevant_blocks(1))
+        def block_and_undo():
+            for cell in cells:
+                position.block(cell)
+                position.unblock(cell)
+        update = time_per_call(block_and_undo, repeat=20) / len(cells)
+        print("%-10s | %9.1f %9.1f %9.1f %12.1f" % (entry["name"], proximity, escape, scratch, update))
+
+    print()
+    print("Alpha-Beta to depth %d with each evaluation function" % depth)
+    print("%-10s | %10s %9s %8s | %10s %9s %8s" % (
+          "position", "proximity", "time", "move", "escape", "time", "move"))
+    for entry in positions:
+        row = []
+        for heuristic in ("proximity", "escape"):
+            game = make_game(entry)
+            game.heuristic = heuristic
+            row.append(run_alphabeta(game, depth))
+        (move1, value1, nodes1, time1), (move2, value2, nodes2, time2) = row
+        print("%-10s | %10d %8.3fs %8s | %10d %8.3fs %8s" % (
+              entry["name"], nodes1, time1, move1, nodes2, time2, move2))
+
+
+def deepen(game, depth):
+    """Iterative Deepening from depth 1 to depth, as Game.iterative_deepening
+    does it but without a deadline. Returns (move, value, nodes, seconds).
+    """
+    def search():
+        move, value = game.alphabeta(max_depth=1)
+        for d in range(2, depth+1):
+            game.reached_maxdepth = False
+            if game.pvs:
+                move, value = game.aspiration(d, value)
+            else:
+                move, value = game.alphabeta(max_depth=d)
+            if not game.reached_maxdepth:
+                break
+        return move, value
+    (move, value), nodes, seconds = timed(game, search)
+    return move, value, nodes, seconds
+
+
+def bench_deepening(depth, positions, setting, title, off, on):
+    """Compare Iterative Deepening to depth with the Game attribute
+    setting off and on.
+    """
+    print("Iterative Deepening to depth %d: %s" % (depth, title))
+    print("%-10s | %10s %9s %8s | %10s %9s %8s | %s" % (
+          "position", off + " nodes", "time", "move", on + " nodes", "time", "move", "same value"))
+    totals = [0, 0.0, 0, 0.0, 0]
+    for entry in positions:
+        row = []
+        for value in (False, True):
+            game = make_game(entry)
+            setattr(game, setting, value)
+            row.append(deepen(game, depth))
+        (move1, value1, nodes1, time1), (move2, value2, nodes2, time2) = row
+        same = value1 == value2
+        print("%-10s | %10d %8.3fs %8s | %10d %8.3fs %8s | %s" % (
+              entry["name"], nodes1, time1, move1, nodes2, time2, move2, "yes" if same else "NO"))
+        for k, x in enumerate((nodes1, time1, nodes2, time2, same)):
+            totals[k] += x
+    print("%-10s | %10d %8.3fs %8s | %10d %8.3fs %8s | %d/%d" % (
+          "total", totals[0], totals[1], "", totals[2], totals[3], "", totals[4], len(positions)))
+
+
+def bench_proof(positions, timeout):
+    """Compare proof-number search with Iterative Deepening Alpha-Beta at
+    proving the result of each position.
+    """
+    def deepen_to_proof(game):
+        cells = game.size**2
+        for depth in range(1, cells):
+            game.reached_maxdepth = False
+            move, value = game.alphabeta(max_depth=depth)
+            if game.terminated:
+                return None
+            if abs(value) >= 100*(cells-depth) or not game.reached_maxdepth:
+                return value > 0
+
+    names = {True: "cat", False: "blocker", None: "-"}
+    print("Proving the winner within %gs" % timeout)
+    print("%-10s | %8s %10s %9s | %8s %10s %9s" % (
+          "position", "df-pn", "nodes", "time", "ab", "nodes", "time"))
+    for entry in positions:
+        game = make_game(entry)
+        (result1, cell, placeholder), nodes1, time1 = timed(
+            game, lambda: prove(game, game.proof_nodes, game.proof_entries, game.deadline), timeout)
+        game = make_game(entry)
+        result2, nodes2, time2 = timed(game, lambda: deepen_to_proof(game), timeout)
+        print("%-10s | %8s %10d %8.3fs | %8s %10d %8.3fs" % (
+              entry["name"], names[result1], nodes1, time1, names[result2], nodes2, time2))
+
+
+CLOCK_DEADLINES = (0.01, 0.05, 0.2)
+
+def bench_clock(depth, positions):
+    """The cost of the time checks, and the cats against short deadlines."""
+    poll_nodes = Game(5).poll_nodes
+    print("Alpha-Beta to depth %d, reading the clock every node and every %d nodes" % (depth, poll_nodes))
+    print("%-10s | %10s %9s | %9s" % ("position", "nodes", "every 1", "every %d" % poll_nodes))
+    totals = [0.0, 0.0]
+    for entry in positions:
+        row = []
+        for poll in (1, poll_nodes):
+            game = make_game(entry)
+            game.poll_nodes = poll
+            row.append(run_alphabeta(game, depth))
+        (move1, value1, nodes, time1), (move2, value2, nodes2, time2) = row
+        print("%-10s | %10d %8.3fs %8.3fs" % (entry["name"], nodes, time1, time2))
+        totals[0] += time1
+        totals[1] += time2
+    print("%-10s | %10s %8.3fs %8.3fs  (%+.1f%%)" % (
+          "total", "", totals[0], totals[1], 100 * (totals[1] / totals[0] - 1)))
+
+    print()
+    print("%-10s %8s | %9s %9s %9s %12s %10s" % (
+          "cat", "deadline", "fallbacks", "forfeits", "late", "latest", "average"))
+    for name, args in (("alphabeta", (False, True, False, 0, False)), ("id", (False, True, False, 0, True))):
+        for deadline in CLOCK_DEADLINES:
+            fallbacks = forfeits = late = 0
+            latest = float("-inf")
+            total = 0.0
+            for entry in positions:
+                game = make_game(entry)
+                start = time.time()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    move = game.CustomCat(*args, deadline)
+                elapsed = time.time() - start
+                fallbacks += game.fell_back
+                forfeits += move in ([-1,-1], [game.cat_i,game.cat_j])
+                late += elapsed > deadline
+                latest = max(latest, elapsed - deadline)
+                total += elapsed
+            print("%-10s %7.3fs | %9d %9d %9d %+10.2fms %8.2fms" % (
+                  name, deadline, fallbacks, forfeits, late, 1000 * latest, 1000 * total / len(positions)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for CatGame.py")
+    parser.add_argument("bench", choices=["corpus", "suite", "blockers", "eval", "pvs", "ordering", "batch", "symmetry", "proof", "clock"])
+    parser.add_argument("--depth", type=int, default=4, help="search depth of the other benchmarks (default 4)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[7, 9, 11, 13],
+                        help="board sizes of the other benchmarks (default 7 9 11 13)")
+    parser.add_argument("--deadline", type=float, default=0.5,
+                        help="Iterative Deepening deadline in seconds (default 0.5)")
+    parser.add_argument("--repeat", type=int, default=3, help="suite runs to take the best time of (default 3)")
+    parser.add_argument("--save", help="JSON file to write the suite results to")
+    parser.add_argument("--baseline", help="JSON file of suite results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed regression, 0.25 is 25%% (default)")
+    parser.add_argument("--min-time", type=float, default=0.005,
+                        help="don't compare times under this many seconds (default 0.005)")
+    args = parser.parse_args()
+
+    if args.bench == "corpus":
+        with open(CORPUS, "w") as f:
+            json.dump(generate_corpus(), f, indent=1)
+        print("Wrote", CORPUS)
+    elif args.bench == "suite":
+        results = run_suite(args.deadline, args.repeat)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=1)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if compare(results, baseline, args.threshold, args.min_time):
+                sys.exit(1)
+    elif args.bench == "blockers":
+        bench_blockers(args.depth, load_corpus(args.sizes))
+    elif args.bench == "eval":
+        bench_eval(args.depth, load_corpus(args.sizes))
+    elif args.bench == "pvs":
+        bench_deepening(args.depth, load_corpus(args.sizes), "pvs",
+                        "Alpha-Beta vs. PVS with aspiration windows", "ab", "pvs")
+    elif args.bench == "ordering":
+        bench_deepening(args.depth, load_corpus(args.sizes), "history_ordering",
+                        "without vs. with killers and history", "plain", "k+h")
+    elif args.bench == "batch":
+        bench_deepening(args.depth, load_corpus(args.sizes), "batch_leaves",
+                        "leaves one by one vs. in batches", "single", "batch")
+    elif args.bench == "symmetry":
+        bench_deepening(args.depth, load_corpus(args.sizes), "symmetry",
+                        "plain vs. canonical table keys", "plain", "mirror")
+    elif args.bench == "proof":
+        bench_proof(load_corpus(args.sizes), args.deadline)
+    elif args.bench == "clock":
+        bench_clock(args.depth, load_corpus(args.sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+#
+# Bitboard representation of a Cat Trap position.
+#
+# The cells of an NxN board are numbered row by row, cell = i*size + j,
+# and a set of cells is a plain Python int with bit `cell` set.
+# Odd rows are shifted half a tile to the right, just like in
+# CatGame.Game.target, so the neighbours of a cell depend on its row parity.
+#
+
+import random
+from heapq import heappush, heappop
+import numpy as np
+
+# The order in which Game.valid_moves reports the cat's moves.
+DIRECTIONS = ("E", "W", "NE", "NW", "SE", "SW")
+
+# (di, dj) of each direction, from an even row and from an odd row
+OFFSETS = (
+    {"E": (0, 1), "W": (0, -1), "NE": (-1, 0), "NW": (-1, -1), "SE": (1, 0), "SW": (1, -1)},
+    {"E": (0, 1), "W": (0, -1), "NE": (-1, 1), "NW": (-1, 0), "SE": (1, 1), "SW": (1, 0)},
+)
+
+
+def cells_of(mask):
+    """Yield the cells of a mask, lowest cell first (raster order)."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BoardGeometry(object):
+    """Masks that only depend on the board size.
+    Don't build these directly, use geometry(size) to get the cached one.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.cells = size*size
+        self.full = (1 << self.cells) - 1
+
+        row = (1 << size) - 1
+        first_col = last_col = even_rows = 0
+        for i in range(size):
+            first_col |= 1 << (i*size)
+            last_col |= 1 << (i*size + size-1)
+            if i%2 == 0:
+                even_rows |= row << (i*size)
+        self.first_col = first_col
+        self.last_col = last_col
+        self.even_rows = even_rows
+        self.odd_rows = self.full & ~even_rows
+        self.border = row | (row << (size*(size-1))) | first_col | last_col
+
+        # step[d][cell] -- the neighbour in DIRECTIONS[d], -1 off the board
+        # adjacent[cell] -- the neighbours on the board, in DIRECTIONS order
+        # neighbours[cell] -- the same as a mask
+        # rays[cell][d] -- the cells from cell to the border in DIRECTIONS[d]
+        # ray_masks[cell][d] -- the same as a mask
+        self.step = [[self._walk(cell, dir) for cell in range(self.cells)] for dir in DIRECTIONS]
+        self.adjacent = []
+        self.neighbours = []
+        self.rays = []
+        self.ray_masks = []
+        for cell in range(self.cells):
+            adjacent = tuple(step[cell] for step in self.step if step[cell] >= 0)
+            self.adjacent.append(adjacent)
+            self.neighbours.append(sum(1 << n for n in adjacent))
+            rays = []
+            for step in self.step:
+                ray = []
+                n = step[cell]
+                while n >= 0:
+                    ray.append(n)
+                    n = step[n]
+                rays.append(tuple(ray))
+            self.rays.append(tuple(rays))
+            self.ray_masks.append(tuple(sum(1 << n for n in ray) for ray in rays))
+
+        # The same as NumPy arrays, for evaluating many boards at once. Cell
+        # `cells` stands for off the board: rows of boards get one more column.
+        # ray_cells[cell, d, k] -- rays[cell][d][k], padded with `cells`
+        # ray_lengths[cell, d] -- len(rays[cell][d])
+        # border_cells[cell] -- True on the border
+        # adjacent_cells[cell, d] -- step[d][cell], `cells` off the board
+        longest = max(size-1, 1)
+        self.ray_cells = np.full((self.cells, 6, longest), self.cells, np.intp)
+        self.ray_lengths = np.zeros((self.cells, 6), np.intp)
+        for cell in range(self.cells):
+            for d, ray in enumerate(self.rays[cell]):
+                self.ray_cells[cell, d, :len(ray)] = ray
+                self.ray_lengths[cell, d] = len(ray)
+        self.border_cells = np.array([(self.border >> cell) & 1 for cell in range(self.cells)], bool)
+        self.adjacent_cells = np.array([[n if n >= 0 else self.cells for n in step] for step in self.step],
+                                       np.intp).T.copy()
+
+        # Zobrist keys, seeded by the size so that every process agrees on them
+        rand = random.Random(size)
+        self.zobrist_block = [rand.getrandbits(64) for cell in range(self.cells)]
+        self.zobrist_cat = [rand.getrandbits(64) for cell in range(self.cells)]
+        self.zobrist_blocker = rand.getrandbits(64)   # xor-ed in when the blocker is to move
+
+        # The board's one symmetry besides the identity. Flipping the rows
+        # top to bottom keeps the layout when the flip maps even rows to even
+        # rows, that is on odd sizes; on even sizes the rows change parity,
+        # which turning the board half round (flipping the columns too)
+        # makes up for. A left-right flip alone never works: it turns the
+        # even rows' neighbours into the odd rows' ones.
+        # mirror[cell] -- the image of cell; mirror[-1] is -1, for "no move"
+        # identity[cell] -- cell, the same way
+        # zobrist_mirror_block[cell], zobrist_mirror_cat[cell] -- the Zobrist
+        #   keys of the image, so that a position can keep the key of its
+        #   mirror image up to date as well (Position.mirror_hash)
+        last = size-1
+        if size % 2:
+            self.mirror = [(last-i)*size + j for i in range(size) for j in range(size)]
+        else:
+            self.mirror = [(last-i)*size + last-j for i in range(size) for j in range(size)]
+        self.mirror.append(-1)
+        self.identity = list(range(self.cells)) + [-1]
+        self.zobrist_mirror_block = [self.zobrist_block[self.mirror[cell]] for cell in range(self.cells)]
+        self.zobrist_mirror_cat = [self.zobrist_cat[self.mirror[cell]] for cell in range(self.cells)]
+
+    def zobrist(self, blocked, cat):
+        key = 0
+        for cell in cells_of(blocked):
+            key ^= self.zobrist_block[cell]
+        if cat >= 0:
+            key ^= self.zobrist_cat[cat]
+        return key
+
+    def mirror_mask(self, mask):
+        """The image of a mask under the board's symmetry (see mirror)."""
+        size = self.size
+        if size % 2 == 0:
+            # half round: the cells in reverse order
+            return int(format(mask, "0%db" % self.cells)[::-1], 2)
+        row = (1 << size) - 1
+        out = 0
+        for i in range(size):
+            out |= ((mask >> (i*size)) & row) << ((size-1-i)*size)
+        return out
+
+    def _walk(self, cell, dir):
+        i, j = divmod(cell, self.size)
+        di, dj = OFFSETS[i%2][dir]
+        i, j = i+di, j+dj
+        if 0 <= i < self.size and 0 <= j < self.size:
+            return i*self.size + j
+        return -1
+
+    def __deepcopy__(self, memo):
+        return self     # shared and never modified
+
+    def dilate(self, mask):
+        """Return mask plus all the neighbours of its cells."""
+        size = self.size
+        out = mask
+        out |= (mask & ~self.last_col) << 1             # E
+        out |= (mask & ~self.first_col) >> 1            # W
+        out |= (mask >> size) | (mask << size)          # same column, row above/below
+        even = mask & self.even_rows & ~self.first_col  # even rows reach column j-1
+        out |= (even >> (size+1)) | (even << (size-1))
+        odd = mask & self.odd_rows & ~self.last_col     # odd rows reach column j+1
+        out |= (odd >> (size-1)) | (odd << (size+1))
+        return out & self.full
+
+
+_geometries = {}
+
+def geometry(size):
+    """Return the (cached) BoardGeometry of an NxN board."""
+    geo = _geometries.get(size)
+    if geo is None:
+        geo = _geometries[size] = BoardGeometry(size)
+    return geo
+
+
+class Position(object):
+    """The blocked cells and the cat cell of a board.
+    A cat cell of -1 means that there is no cat on the board.
+    hash is the Zobrist key of the position, kept up to date incrementally,
+    and mirror_hash the key of its mirror image (see BoardGeometry.mirror).
+    A pickled Position is just its size, blocked mask and cat cell.
+    """
+    __slots__ = ("size", "geometry", "blocked", "cat", "hash", "mirror_hash", "escape")
+
+    def __init__(self, size, blocked=0, cat=-1):
+        self.size = size
+        self.geometry = geometry(size)
+        self.blocked = blocked
+        self.cat = cat
+        self.hash = self.geometry.zobrist(blocked, cat)
+        self.mirror_hash = self.geometry.zobrist(self.geometry.mirror_mask(blocked), self.geometry.mirror[cat])
+        self.escape = None      # an EscapeMap, once track_escape is called
+
+    def __reduce__(self):
+        return Position, (self.size, self.blocked, self.cat)
+
+    def cell(self, i, j):
+        return i*self.size + j
+
+    def key(self, blocker_to_move=False):
+        """Return (key, frame): the canonical Zobrist key of the position,
+        the smaller of hash and mirror_hash (with zobrist_blocker xor-ed in
+        when the blocker is to move), so that a position and its mirror
+        image share it. A table entry under a key is about the position
+        whose hash that is: frame, geometry.mirror or geometry.identity,
+        maps its moves to this position and back.
+        """
+        geo = self.geometry
+        key, mirrored_key = self.hash, self.mirror_hash
+        if blocker_to_move:
+            key ^= geo.zobrist_blocker
+            mirrored_key ^= geo.zobrist_blocker
+        if mirrored_key < key:
+            return mirrored_key, geo.mirror
+        return key, geo.identity
+
+    def is_blocked(self, cell):
+        return (self.blocked >> cell) & 1 == 1
+
+    def is_free(self, cell):
+        return not (self.blocked >> cell) & 1 and cell != self.cat
+
+    def free_cells(self):
+        """Mask of the cells where a block may be placed."""
+        free = self.geometry.full & ~self.blocked
+        if self.cat >= 0:
+            free &= ~(1 << self.cat)
+        return free
+
+    def cat_moves(self):
+        """The cells the cat can move to, in DIRECTIONS order."""
+        if self.cat < 0:
+            return []
+        blocked = self.blocked
+        return [cell for cell in self.geometry.adjacent[self.cat] if not (blocked >> cell) & 1]
+
+    def free_neighbours(self):
+        """Mask of the cells the cat can move to."""
+        if self.cat < 0:
+            return 0
+        return self.geometry.neighbours[self.cat] & ~self.blocked
+
+    def cat_on_border(self):
+        return self.cat >= 0 and (self.geometry.border >> self.cat) & 1 == 1
+
+    def block(self, cell):
+        if not (self.blocked >> cell) & 1:
+            self.blocked |= 1 << cell
+            geo = self.geometry
+            self.hash ^= geo.zobrist_block[cell]
+            self.mirror_hash ^= geo.zobrist_mirror_block[cell]
+            if self.escape is not None:
+                self.escape.block(cell)
+
+    def unblock(self, cell):
+        if (self.blocked >> cell) & 1:
+            self.blocked &= ~(1 << cell)
+            geo = self.geometry
+            self.hash ^= geo.zobrist_block[cell]
+            self.mirror_hash ^= geo.zobrist_mirror_block[cell]
+            if self.escape is not None:
+                self.escape.unblock(cell)
+
+    def move_cat(self, cell):
+        geo = self.geometry
+        if self.cat >= 0:
+            self.hash ^= geo.zobrist_cat[self.cat]
+            self.mirror_hash ^= geo.zobrist_mirror_cat[self.cat]
+        if cell >= 0:
+            self.hash ^= geo.zobrist_cat[cell]
+            self.mirror_hash ^= geo.zobrist_mirror_cat[cell]
+        self.cat = cell
+
+    def relevant_blocks(self, cat_moves):
+        """Yield the free cells worth blocking when the cat has cat_moves
+        moves left in the search: first the cells on the cat's shortest
+        escape routes, then the cells within cat_moves+1 steps of it, both
+        nearest to the cat first. Cells further away can't change where the
+        cat goes before the search ends.
+        """
+        for layer in self.relevant_layers(cat_moves):
+            yield from cells_of(layer)
+
+    def relevant_layers(self, cat_moves):
+        """Yield the cells of relevant_blocks as disjoint masks, one per
+        distance from the cat, in the same order.
+        """
+        if self.cat < 0:
+            return
+        geo = self.geometry
+        free = self.free_cells()
+        catbit = 1 << self.cat
+
+        # breadth-first layers of free cells around the cat, until the border
+        layers = [catbit]
+        reach = catbit
+        while not reach & geo.border:
+            grown = geo.dilate(reach) & free & ~reach
+            if not grown:
+                break
+            layers.append(grown)
+            reach |= grown
+
+        # walk back from the nearest border cells to collect the shortest routes
+        routes = 0
+        if reach & geo.border:
+            on_route = layers[-1] & geo.border
+            for k in range(len(layers)-1, 0, -1):
+                routes |= on_route
+                on_route = layers[k-1] & geo.dilate(on_route)
+
+        for layer in layers[1:]:
+            if layer & routes:
+                yield layer & routes
+
+        # then everything the cat might still step on or next to
+        seen = routes | catbit
+        zone = catbit
+        steps = 0
+        while steps <= cat_moves:
+            layer = geo.dilate(zone) & free & ~zone
+            if not layer:
+                break
+            zone |= layer
+            steps += 1
+            if layer & ~seen:
+                yield layer & ~seen
+
+    def track_escape(self):
+        """Start keeping an EscapeMap of this position up to date."""
+        if self.escape is None:
+            self.escape = EscapeMap(self)
+        return self.escape
+
+    def blocked_board(self):
+        """The blocked cells as an NxN boolean array."""
+        cells = self.geometry.cells
+        data = np.frombuffer(self.blocked.to_bytes(cells//8 + 1, "little"), np.uint8)
+        return np.unpackbits(data, count=cells, bitorder="little").astype(bool).reshape(self.size, self.size)
+
+    def tiles(self):
+        """The board as an NxN array: 0 for free, 1 for blocked, 6 for the cat."""
+        size = self.size
+        bits = [(self.blocked >> cell) & 1 for cell in range(size*size)]
+        tiles = np.array(bits).reshape(size, size)
+        if self.cat >= 0:
+            tiles[self.cat // size][self.cat % size] = 6
+        return tiles
+
+
+class EscapeMap(object):
+    """Distance from every cell to the border, walking through free cells.
+    The cat doesn't block its own cell, so the map doesn't depend on where
+    the cat is, and only has to be updated when a block is added or removed.
+    dist[cell] is `unreachable` for blocked cells and for enclosed ones.
+    """
+    def __init__(self, position):
+        self.position = position
+        self.geometry = geo = position.geometry
+        self.unreachable = geo.cells
+        self.dist = [self.unreachable] * geo.cells
+        dist = self.dist
+        frontier = [cell for cell in cells_of(geo.border & ~position.blocked)]
+        for cell in frontier:
+            dist[cell] = 0
+        d = 0
+        while frontier:
+            d += 1
+            next_frontier = []
+            for cell in frontier:
+                for n in geo.adjacent[cell]:
+                    if dist[n] > d and not (position.blocked >> n) & 1:
+                        dist[n] = d
+                        next_frontier.append(n)
+            frontier = next_frontier
+
+    def escape_route(self, cat):
+        """Return (distance, exits): the length of the cat's shortest way
+        out and the number of border cells it can reach at that length.
+        """
+        dist, adjacent = self.dist, self.geometry.adjacent
+        d = dist[cat]
+        if d == self.unreachable:
+            return d, 0
+        frontier = {cat}
+        while d > 0:
+            d -= 1
+            frontier = {n for cell in frontier for n in adjacent[cell] if dist[n] == d}
+        return dist[cat], len(frontier)
+
+    def block(self, cell):
+        """Update the map after cell got blocked: distances can only grow."""
+        dist, adjacent = self.dist, self.geometry.adjacent
+        blocked = self.position.blocked
+        unreachable = self.unreachable
+        if dist[cell] == unreachable:
+            return
+
+        # find the cells that lost every neighbour one step closer to the border
+        lost = {cell}
+        level = [cell]
+        while level:
+            next_level = []
+            for u in level:
+                d = dist[u] + 1
+                for v in adjacent[u]:
+                    if dist[v] != d or v in lost:
+                        continue
+                    for w in adjacent[v]:
+                        if dist[w] == d-1 and w not in lost and not (blocked >> w) & 1:
+                            break
+                    else:
+                        lost.add(v)
+                        next_level.append(v)
+            level = next_level
+
+        # and route them again from their neighbours that kept their distance
+        dist[cell] = unreachable
+        lost.discard(cell)
+        heap = []
+        for v in lost:
+            best = unreachable
+            for w in adjacent[v]:
+                if w not in lost and dist[w] + 1 < best:
+                    best = dist[w] + 1
+            dist[v] = best
+            if best < unreachable:
+                heappush(heap, (best, v))
+        while heap:
+            d, v = heappop(heap)
+            if d > dist[v]:
+                continue
+            for w in adjacent[v]:
+                if w in lost and dist[w] > d + 1:
+                    dist[w] = d + 1
+                    heappush(heap, (d + 1, w))
+
+    def unblock(self, cell):
+        """Update the map after cell got freed: distances can only shrink."""
+        dist, adjacent = self.dist, self.geometry.adjacent
+        if (self.geometry.border >> cell) & 1:
+            d = 0
+        else:
+            d = min(dist[n] for n in adjacent[cell]) + 1
+        if d >= self.unreachable:
+            return
+        dist[cell] = d
+        blocked = self.position.blocked
+        level = [cell]
+        while level:
+            d += 1
+            next_level = []
+            for u in level:
+                for v in adjacent[u]:
+                    if dist[v] > d and not (blocked >> v) & 1:
+                        dist[v] = d
+                        next_level.append(v)
+            level = next_level
@@ -7,8 +7,15 @@
 #
 
 import hexutil
+from CatBoard import Position, cells_of, DIRECTIONS, OFFSETS
+from CatTable import TranspositionTable, bound, EXACT, LOWER, UPPER
+from CatStats import SearchStats
+from CatSearch import SearchContext, in_context
+from CatSolver import solved_board, SolvedBoard
+from CatProof import prove
+from CatMCTS import MonteCarloTree
+from functools import cached_property
 import random
-import copy
 import time
 import numpy as np
 
@@ -25,38 +32,168 @@ class InvalidMove(ValueError):
 class Game(object):
     """Represents a game state.
     """
+    # The state of the search in progress is in self.context (see CatSearch.py)
+    deadline = in_context("deadline")
+    start_time = in_context("start_time")
+    terminated = in_context("terminated")
+    reached_maxdepth = in_context("reached_maxdepth")
+    polls_left = in_context("polls_left")
+    tt_root = in_context("tt_root")
+    stats = in_context("stats")                 # SearchStats of the last CustomCat, see CatStats.py
+    cancelled = in_context("cancelled")         # set by cancel
+
+    # What it keeps for the whole game is built on first use, so that a Game
+    # that never searches (an unpickled one, say) doesn't pay for it.
+    per_game = ("tt", "proof_table", "mcts", "killers", "cat_history", "block_history")
+
+    @cached_property
+    def tt(self):
+        return TranspositionTable()
+
+    @cached_property
+    def proof_table(self):
+        return {}                        # the proof and disproof numbers, see CatProof.py
+
+    @cached_property
+    def mcts(self):
+        return MonteCarloTree()          # the Monte Carlo Cat's tree, see CatMCTS.py
+
+    @cached_property
+    def killers(self):
+        return [[-1,-1] for depth in range(2*self.size**2+1)]   # per ply: a block and a cat move per round
+
+    @cached_property
+    def cat_history(self):
+        return [0] * self.size**2
+
+    @cached_property
+    def block_history(self):
+        return [0] * self.size**2
+
+    # What a pickled (or deep-copied) Game leaves out: its search context and
+    # what it keeps for the whole game. The copy starts with fresh ones.
+    unpickled = ("context", "undo_stack", "on_progress", "pv") + per_game
+
     def __init__(self, size):
-        self.cat_i = size//2
-        self.cat_j = size//2
         self.size  = size
-        self.tiles = np.array([[0 for col in range(size)] for row in range(size)])
-        self.deadline = 0
-        self.terminated = False
-        self.start_time = time.time()
+        self.position = Position(size, cat=(size//2)*size + size//2)
+        self.context = SearchContext()
         self.eval_fn = CatEvalFn()
-        self.reached_maxdepth = False 
+        self.undo_stack = []
+        self.full_scan = False           # True: the blocker tries every free tile
+        self.heuristic = "proximity"     # or "escape", see utility
+        self.depth_reached = 0           # by the last iterative_deepening
+        self.collect_stats = False       # True: each CustomCat fills self.stats
+        self.stats_log = None            # JSONL file to append the stats to
+        self.on_progress = None          # called with (depth, [i,j]) as iterative_deepening finishes each depth
+        self.workers = 0                 # >1: Alpha-Beta splits the root over that many processes
+        self.ybw = False                 # True: ... with Young Brothers Wait, see CatParallel.py
+        self.smp = False                 # True: Iterative Deepening runs Lazy SMP on the workers instead
+        self.pvs = False                 # True: Principal Variation Search and aspiration windows
+        self.pv = []                     # principal variation of the last alphabeta, as cells
+        self.history_ordering = True     # order moves by killers and history, see order_moves
+        self.symmetry = True             # a position and its mirror image share their table entries, see table_key
+        self.use_solved = True           # play from the solved-position file when there is one
+        self.proof_nodes = 100000        # node budget of the proof-number search, see CatProof.py
+        self.proof_entries = 1 << 19     # size budget of its table
+        self.poll_nodes = 16             # the searches look at the clock every so many nodes
+        self.soft_share = 0.8            # ID starts no new depth past this share of the allotted time
+        self.fell_back = False           # True: the last CustomCat ran out of time and used fallback_move
+        self.batch_leaves = True         # Alpha-Beta scores sibling leaves together (proximity only), see frontier_min_Value
+        self.batch_min = 12              # ... when there are at least that many
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in self.unpickled:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.context = SearchContext()
+        self.undo_stack = []
+        self.on_progress = None
+        self.pv = []
+
+    # The board lives in self.position as bitmasks (see CatBoard.py).
+    # These properties are the read-only [i,j] view used by the GUI.
+
+    @property
+    def tiles(self):
+        tiles = self.position.tiles()
+        tiles.flags.writeable = False   # a copy: writing to it wouldn't change the board
+        return tiles
+
+    @property
+    def cat_i(self):
+        cat = self.position.cat
+        return cat // self.size if cat >= 0 else -1
+
+    @property
+    def cat_j(self):
+        cat = self.position.cat
+        return cat % self.size if cat >= 0 else -1
+
+    def place_block(self,i,j):
+        self.position.block(i*self.size+j)
+
+    def remove_block(self,i,j):
+        self.position.unblock(i*self.size+j)
+
+    def is_blocked(self,i,j):
+        return self.position.is_blocked(i*self.size+j)
+
+    def place_cat(self,i,j):
+        cell = i*self.size+j
+        self.position.unblock(cell)
+        self.position.move_cat(cell)
+
+    def remove_cat(self):
+        self.position.move_cat(-1)
+
+    def search_copy(self):
+        """A game on a copy of the position, sharing the transposition table
+        and the settings, for a search to run in another thread.
+        """
+        game = object.__new__(type(self))     # copy.copy would drop the tables, see __getstate__
+        for name in self.per_game:
+            getattr(self, name)               # build them here, so that both games share them
+        game.__dict__.update(self.__dict__)
+        game.position = Position(self.size, self.position.blocked, self.position.cat)
+        game.context = SearchContext()
+        game.undo_stack = []
+        game.on_progress = None
+        return game
+
+    def cancel(self):
+        """Stop the running search (from another thread), as if time was up.
+        A CustomCat call that hasn't started yet stops right away too.
+        """
+        self.cancelled = True
+        self.deadline = 0
 
     def init_random_blocks(self,cat):
         n = random.randint(round(0.067*(self.size**2)),round(0.13*(self.size**2)))
         count = 0
-        the_blocks=[]
-        self.cat_i,self.cat_j = hex_to_ij(cat)
-        self.tiles[self.cat_i][self.cat_j] = 6
+        i,j = hex_to_ij(cat)
+        self.place_cat(i,j)
         
+        position = self.position
         while count < n:
             i = random.randint(0,self.size-1)
             j = random.randint(0,self.size-1)
-            if self.tiles[i][j]==0:
-                self.tiles[i][j] = 1
+            cell = i*self.size+j
+            if position.is_free(cell):
+                position.block(cell)
                 count = count + 1    
 
     def init_blocks(self,the_blocks,cat):
         i,j=hex_to_ij(cat)
-        self.tiles[i][j] = 6
+        self.place_cat(i,j)
         
         for block in the_blocks:
             if block != [i,j]:
-                self.game.tiles[block[0]][block[1]] = 1
+                self.place_block(block[0],block[1])
 
     # Intelligent Agents
     #
@@ -74,30 +211,65 @@ class Game(object):
     #                ab: Use Alpha-Beta Pruning
     #               DLS: Use Depth-Limited Search, with the maximum depth in the max_depth argument
     #                ID: Use Iterative Deepening, with the allotted time in the alotted_time argument
+    #           workers: Split the Alpha-Beta root over this many processes (CatParallel.py)
+    #               ybw: ... searching the eldest root move first (Young Brothers Wait)
+    #               smp: With ID and workers, run Lazy SMP instead: all the workers deepen the
+    #                    whole tree, sharing one transposition table (CatParallel.py)
+    #               pvs: With ab, use Principal Variation Search, and aspiration windows with ID
+    #             proof: Try to prove the result with proof-number search first (CatProof.py),
+    #                    and use ID when it isn't proved within the budget
+    #              mcts: Use Monte Carlo Tree Search (CatMCTS.py) until the allotted time is up
     #
     #        If none of these flags is true, simple minimax is used. 
-
-    def CustomCat(self,randcat,ab,DLS,max_depth,ID,alotted_time):
+    #        On boards solved by CatSolver.py, all but the Random Cat play from the
+    #        solved-position file instead, unless self.use_solved is False.
+
+    def CustomCat(self,randcat,ab,DLS,max_depth,ID,alotted_time,workers=0,ybw=False,smp=False,pvs=False,proof=False,mcts=False):
+        self.workers = workers
+        self.ybw = ybw
+        self.smp = smp
+        self.pvs = pvs
+        self.age_history()
         self.reached_maxdepth = False 
+        self.terminated = False
+        self.stats = SearchStats() if self.collect_stats else None
         self.start_time = time.time()
         self.deadline = self.start_time + alotted_time 
                          #                ^^^^^^^^^^^^ 
                          # Here's the timeout in seconds for forever-taking Cats.
-                         # This timeout results in a losing cat.
+                         # When it runs out before any search finished, the cat
+                         # plays fallback_move instead of giving up.
                          # This value is also used for Iterative Deepening
                          # as a deadline for the cat to respond.
+        if self.cancelled:
+            self.deadline = 0
+        solved = solved_board(self.size) if self.use_solved else None
         if randcat:
             result = self.RandomCat()    
+        elif solved is not None and solved.covers(self.position):
+            result = self.SolvedCat(solved)
+        elif proof:
+            result = self.ProofNumberCat(ab=ab)
+        elif mcts:
+            result = self.MonteCarloCat()
         elif DLS:
             result = self.DepthLimitedCat(max_depth=max_depth, ab=ab)
         elif ID:
-            self.deadline = self.start_time + alotted_time
             result = self.IterativeDeepeningCat(ab=ab)
         else:
             result = self.AlphaBetaCat() if ab else self.MinimaxCat()
+        self.fell_back = (self.terminated and result in ([-1,-1], [self.cat_i,self.cat_j])
+                          and len(self.position.cat_moves()) > 0)
+        if self.fell_back:
+            result = self.fallback_move()
             
         elapsed_time = (time.time() - self.start_time) * 1000
         print ("Elapsed time: %.3fms " % elapsed_time)
+        if self.stats is not None:
+            self.stats.finish()
+        if self.stats is not None and self.stats_log:
+            self.stats.log(self.stats_log, size=self.size, move=result,
+                           depth_reached=self.depth_reached if ID or proof else max_depth)
         return result
 
 
@@ -117,6 +289,49 @@ class Game(object):
         return self.target(self.cat_i,self.cat_j,dir)
 
 
+    # Solved Cat
+    # This Cat plays perfectly, from a solved-position file (CatSolver.py)
+
+    def SolvedCat(self, solved):
+        cell, result = solved.best_move(self.position)
+        print("Solved position:", SolvedBoard.describe(result))
+        if cell < 0:
+            return [self.cat_i,self.cat_j]
+        return self.ij(cell)
+
+
+    # Proof-Number Cat
+    # This Cat proves that it escapes, or that it is trapped, with df-pn
+    # (CatProof.py), within half its time. When that fails, or when it is
+    # trapped anyway, it plays the ID move in the rest of the time.
+
+    def ProofNumberCat(self,ab):
+        self.depth_reached = 0
+        result, cell, nodes = prove(self, self.proof_nodes, self.proof_entries,
+                                    (self.start_time + self.deadline) / 2)
+        print("Proof-number search: %s after %d nodes" % (
+              {True: "the cat escapes", False: "the cat is trapped", None: "no proof"}[result], nodes))
+        if result:
+            return self.ij(cell)
+        move, placeholder = self.iterative_deepening(ab)
+        return move
+
+    # Monte Carlo Cat
+    # This Cat uses Monte Carlo Tree Search, keeping its tree between moves
+
+    def MonteCarloCat(self):
+        cell = self.mcts.search(self)
+        root = self.mcts.root
+        if root.visits:
+            print("Simulations: %d, cat win rate %.2f" % (root.visits, root.wins / root.visits))
+        elif root.result is not None:
+            print("Solved, cat win rate %.2f" % root.result)
+        else:
+            print("No time for a simulation")   # search picked the nearest escape, see MonteCarloTree.search
+        if self.terminated or cell == self.position.cat:
+            return [self.cat_i,self.cat_j]
+        return self.ij(cell)
+
     # Minimax Cat
     # This Cat uses the Minimax Algorithm
 
@@ -142,71 +357,37 @@ class Game(object):
     # This Cat uses the ID Algorithm
 
     def IterativeDeepeningCat(self,ab):
+        if ab and self.smp and self.workers > 1:
+            from CatParallel import lazy_smp        # CatParallel imports this module
+            move, placeholder = lazy_smp(self, self.workers)
+            return move
         move, placeholder = self.iterative_deepening(ab)    
         return move 
 
 #====================================================================================================        
 
-    def valid_moves(self):
-        tiles,cat_i,cat_j=self.tiles,self.cat_i,self.cat_j
-        size = self.size
-        moves=[]
-        if (cat_j<size-1 and tiles[cat_i][cat_j+1]==0):
-            moves.append("E")
-        if (cat_j>0           and tiles[cat_i][cat_j-1]==0):
-            moves.append("W")
-
-        if (cat_i%2)==0:
-            if (cat_i>0  and cat_j<size   and tiles[cat_i-1][cat_j]==0):
-                moves.append("NE")
-        else:
-            if (cat_i>0  and cat_j<size-1 and tiles[cat_i-1][cat_j+1]==0):
-                moves.append("NE")
-
-        if (cat_i%2)==0:
-            if (cat_i>0  and cat_j>0  and tiles[cat_i-1][cat_j-1]==0):
-                moves.append("NW")
-        else:
-            if (cat_i>0  and cat_j>=0 and tiles[cat_i-1][cat_j]==0):
-                moves.append("NW")
-
-        if (cat_i%2)==0:
-            if (cat_i<size-1  and cat_j<size   and tiles[cat_i+1][cat_j]==0):
-                moves.append("SE")
-        else:
-            if (cat_i<size-1  and cat_j<size-1 and tiles[cat_i+1][cat_j+1]==0):
-                moves.append("SE")
+    # Inside the algorithms, tiles are cell indices (i*size + j) and the cat's
+    # moves are the cells it can step on (Position.cat_moves). Directions and
+    # [i,j] pairs are only used by the methods the GUI and the cats return.
 
-        if (cat_i%2)==0:
-            if (cat_i<size-1  and cat_j>0  and tiles[cat_i+1][cat_j-1]==0):
-                moves.append("SW")
-        else:
-            if (cat_i<size-1  and cat_j>0   and tiles[cat_i+1][cat_j]==0):
-                moves.append("SW")
-        return moves
+    def valid_moves(self):
+        position = self.position
+        if position.cat < 0:
+            return []
+        free = position.free_neighbours()
+        step = position.geometry.step
+        return [dir for d, dir in enumerate(DIRECTIONS) if step[d][position.cat] >= 0 and (free >> step[d][position.cat]) & 1]
 
 
     def target(self,i,j,dir):
-        out=[i,j] 
-        if   dir == "E":
-            out=[i,j+1]
-        elif dir =="W":
-            out=[i,j-1]
-        elif dir == "NE":
-            out = [i-1,j] if (i%2)==0 else [i-1,j+1]
-        elif dir == "NW":
-            out=[i-1,j-1] if (i%2)==0 else [i-1,j]
-        elif dir == "SE":
-            out=[i+1,j]   if (i%2)==0 else [i+1,j+1]            
-        elif dir == "SW":    
-            out=[i+1,j-1] if (i%2)==0 else [i+1,j]
-        return out
+        di,dj = OFFSETS[i%2][dir]
+        return [i+di,j+dj]
 
 
     def utility(self, moves, maximizing_player=True):
 
         #terminal cases
-        if self.cat_i==0 or self.cat_i==self.size-1 or self.cat_j==0 or self.cat_j==self.size-1:
+        if self.position.cat_on_border():
             return float(100)
 
         #terminal cases
@@ -215,91 +396,272 @@ class Game(object):
 
         #return self.eval_fn.score_moves(self,maximizing_player)
         #return self.eval_fn.score_challenge(self,maximizing_player)
+        if self.heuristic == "escape":
+            return self.eval_fn.score_escape(self,maximizing_player)
         return self.eval_fn.score_proximity(self,maximizing_player)
 
+    def utility_batch(self, boards, cats, maximizing_player=True):
+        """utility of many positions at once, as a float array, with the
+        proximity heuristic. boards is a (batch, size, size) boolean array,
+        True for blocked, and cats holds the cat cell of each board.
+        """
+        geo = self.position.geometry
+        count = len(cats)
+        padded = np.ones((count, geo.cells+1), bool)    # off the board is blocked
+        padded[:, :geo.cells] = boards.reshape(count, -1)
+        stuck = padded[np.arange(count)[:, None], geo.adjacent_cells[cats]].all(axis=1)
+        scores = self.eval_fn.score_proximity_batch(self, boards, cats, maximizing_player)
+        return np.where(geo.border_cells[cats], 100.0, np.where(stuck, -100.0, scores))
+
+    # Moves are made and unmade in place. undo_stack holds one entry per move:
+    # the blocked cell for a block, or ~old_cell (always negative) for a cat move.
+
     def apply_move(self,move,maximizing_player):
-            if self.tiles[move[0]][move[1]] != 0: 
+            cell = move[0]*self.size + move[1]
+            if not self.position.is_free(cell): 
               raise InvalidMove("Invalid Move!")
+            self.make_move(cell,maximizing_player)
 
-            if maximizing_player:
-                self.tiles[move[0]][move[1]] = 1  
-            else:
-                self.tiles[move[0]][move[1]] = 6        # place cat 
-                self.tiles[self.cat_i][self.cat_j] = 0  # remove old cat
-                self.cat_i = move[0]
-                self.cat_j = move[1]
+    def make_move(self,cell,maximizing_player):
+        position = self.position
+        if maximizing_player:
+            position.block(cell)
+            self.undo_stack.append(cell)
+        else:
+            self.undo_stack.append(~position.cat)
+            position.move_cat(cell)             # the old cat tile is free again
 
+    def undo_move(self):
+        entry = self.undo_stack.pop()
+        if entry >= 0:
+            self.position.unblock(entry)
+        else:
+            self.position.move_cat(~entry)
+
+    def table_key(self, blocker_to_move):
+        """Return (key, frame), the key of the current position in the
+        transposition and proof tables, and the cell map between the moves
+        stored under it and the moves on the board (see Position.key). With
+        self.symmetry off, that's the plain Zobrist key.
+        """
+        position = self.position
+        if self.symmetry:
+            return position.key(blocker_to_move)
+        key = position.hash
+        if blocker_to_move:
+            key ^= position.geometry.zobrist_blocker
+        return key, position.geometry.identity
+
+    def blocker_moves(self,depth,maxdepth,first=-1):
+        """Yield the blocks to try at a min node, `first` first if it is free.
+        Only the tiles that can matter before maxdepth are tried (see
+        Position.relevant_blocks), unless self.full_scan is set.
+        With self.history_ordering, the killers of this ply come next, and
+        each layer of Position.relevant_layers is sorted by history as it
+        is reached, so that a cutoff still stops the generation.
+        """
+        position = self.position
+        free = position.free_cells()
+        tried = 0                       # mask of the cells yielded so far
+        if first >= 0 and (free >> first) & 1:
+            yield first
+            tried = 1 << first
+        if self.full_scan:
+            layers = [free]             # every free tile, in raster order
+        else:
+            cat_moves = maxdepth-depth
+            if cat_moves != float("inf"):
+                cat_moves = cat_moves//2    # inf//2 is nan
+            layers = position.relevant_layers(cat_moves)
+        if not self.history_ordering:
+            for layer in layers:
+                yield from cells_of(layer & ~tried)
+            return
+        layers = list(layers)           # just the masks, a few ints
+        relevant = 0
+        for layer in layers:
+            relevant |= layer
+        for cell in self.killers[depth]:
+            if cell >= 0 and (relevant & ~tried) >> cell & 1:
+                yield cell
+                tried |= 1 << cell
+        history = self.block_history
+        for layer in layers:
+            yield from sorted(cells_of(layer & ~tried), key=history.__getitem__, reverse=True)
+
+    # Killer and history heuristics. A move that causes a cutoff becomes a
+    # killer of its ply (the last two are kept) and earns (remaining depth)^2
+    # in the history table of its side, indexed by cell: the block's cell or
+    # the cat's new cell. Moves are then tried killers first, then by history.
+    # The tables build up over the iterations of a CustomCat call, and
+    # age_history fades them out between moves.
+
+    def order_moves(self, moves, depth, history, first=-1):
+        """Sort moves in place: first, then the killers of this ply, then
+        by history. Ties keep their order.
+        """
+        moves.sort(key=history.__getitem__, reverse=True)
+        for cell in reversed(self.killers[depth]):
+            if cell >= 0 and cell in moves:
+                moves.remove(cell)
+                moves.insert(0, cell)
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+
+    def good_move(self, cell, depth, maxdepth, history):
+        """Record that cell caused a cutoff at depth."""
+        killers = self.killers[depth]
+        if killers[0] != cell:
+            killers[1] = killers[0]
+            killers[0] = cell
+        remaining = min(maxdepth, self.size**2) - depth
+        history[cell] += remaining*remaining
+
+    def age_history(self):
+        """Forget the killers and halve the history, as a new move begins."""
+        for killers in self.killers:
+            killers[0] = killers[1] = -1
+        # in place: a search_copy shares them with the game it was copied from
+        self.cat_history[:] = [h >> 1 for h in self.cat_history]
+        self.block_history[:] = [h >> 1 for h in self.block_history]
+
+    def ij(self,cell):
+        return [cell // self.size, cell % self.size] if cell >= 0 else [-1,-1]
+
+    # The search functions below work on cell indices and on the game itself:
+    # each call makes `move` (-1 at the root) on entry and unmakes it on exit.
                     
-    def max_Value(self, upper_game, move, maximizing_player, depth, maxdepth):
-        if self.time_left()<5:
-            self.terminated=True
-            return [-1,-1],0
-        game=copy.deepcopy(upper_game)
-        if(move!=[-1,-1]):
+    def max_Value(self, move, maximizing_player, depth, maxdepth):
+        ctx = self.context
+        if self.out_of_time():
+            ctx.terminated=True
+            return -1,0
+        if(move!=-1):
             maximizing_player=not(maximizing_player)
-            game.apply_move(move,maximizing_player)
-        
-        legal_moves = game.valid_moves() #["W","E","SE","SW","NE","NW"]
-        if len(legal_moves)==0 or (depth==maxdepth):
-            if (depth==maxdepth):
-              self.reached_maxdepth = True  
-            return [self.cat_i,self.cat_j], (game.size**2 - depth) * game.utility(legal_moves,maximizing_player)
-        v=float("-inf")
-        vtemp=v
-        best_move=game.target(game.cat_i,game.cat_j,legal_moves[0])
-        for s in legal_moves:
-            s_pos=game.target(game.cat_i,game.cat_j,s)
-            
-            vtemp=max(v,self.min_Value(game,s_pos,maximizing_player,depth+1,maxdepth))
-            
-            if self.terminated:
-                return [-1,-1],0
-            if v<vtemp:
-                v=vtemp
-                best_move=s_pos    
-  
-        return best_move,v
-
-    def min_Value(self, upper_game, move, maximizing_player, depth, maxdepth):
-        if self.time_left()<5:
-            self.terminated=True
+            self.make_move(move,maximizing_player)
+        try:
+            stats = ctx.stats
+            if stats is not None:
+                stats.node(depth)
+            position = self.position
+            legal_moves = position.cat_moves()
+            if len(legal_moves)==0 or (depth==maxdepth):
+                if (depth==maxdepth):
+                  ctx.reached_maxdepth = True  
+                if stats is not None:
+                    stats.leaf()
+                return position.cat, (self.size**2 - depth) * self.utility(legal_moves,maximizing_player)
+            v=float("-inf")
+            vtemp=v
+            best_move=legal_moves[0]
+            for s_pos in legal_moves:
+                
+                vtemp=max(v,self.min_Value(s_pos,maximizing_player,depth+1,maxdepth))
+                
+                if ctx.terminated:
+                    return -1,0
+                if v<vtemp:
+                    v=vtemp
+                    best_move=s_pos    
+      
+            return best_move,v
+        finally:
+            if(move!=-1):
+                self.undo_move()
+
+    def min_Value(self, move, maximizing_player, depth, maxdepth):
+        ctx = self.context
+        if self.out_of_time():
+            ctx.terminated=True
             return 0
-        game=copy.deepcopy(upper_game)
         maximizing_player=not(maximizing_player)
-        game.apply_move(move,maximizing_player)
-
-        #legal_moves = game.valid_moves()  # cat just moved, so he hasn't lost.
-                  # Besides, legal moves are free tiles for the cat's opponent.
-        
-        if (depth==maxdepth) or\
-           (game.cat_i==0 or game.cat_i==self.size-1 or game.cat_j==0 or game.cat_j==self.size-1):
-            if (depth==maxdepth):
-                self.reached_maxdepth = True 
-            return (game.size**2 - depth) * game.utility([2,3,4],maximizing_player)
+        self.make_move(move,maximizing_player)
+        try:
+            #legal_moves = game.valid_moves()  # cat just moved, so he hasn't lost.
+                      # Besides, legal moves are free tiles for the cat's opponent.
             
-        v=float("inf")
-        
-        #for s in legal_moves:
-        for i in range(game.size):      # workaround to avoid book-keeping of valid block moves
-            for j in range(game.size):  #
-                if game.tiles[i][j]!=0: #
-                    continue            #
-                s = [i,j]
+            stats = ctx.stats
+            if stats is not None:
+                stats.node(depth)
+            if (depth==maxdepth) or self.position.cat_on_border():
+                if (depth==maxdepth):
+                    ctx.reached_maxdepth = True 
+                if stats is not None:
+                    stats.leaf()
+                return (self.size**2 - depth) * self.utility([2,3,4],maximizing_player)
+                
+            v=float("inf")
+            
+            #for s in legal_moves:
+            for s in self.blocker_moves(depth,maxdepth):
 
-                placeholder,temp = self.max_Value(game,s,maximizing_player,depth+1,maxdepth)
+                placeholder,temp = self.max_Value(s,maximizing_player,depth+1,maxdepth)
 
                 v = min(v,temp)
-                if self.terminated:
+                if ctx.terminated:
                     return 0
-        return v
+            return v
+        finally:
+            self.undo_move()
 
     def minimax(self, max_depth=float("inf"), maximizing_player=True):
-        best_move, best_val = self.max_Value(self,[-1,-1],maximizing_player,0,max_depth)
-        return best_move, best_val
+        if self.stats is not None:
+            self.stats.start_iteration()
+        best_move, best_val = self.max_Value(-1,maximizing_player,0,max_depth)
+        if self.stats is not None:
+            self.stats.end_iteration(max_depth, not self.terminated)
+        return self.ij(best_move), best_val
 
     def time_left(self):
         return  (self.deadline - time.time()) * 1000
 
+    # Time management. The hard limit is 5ms before the deadline: a search
+    # that reaches it stops at once (self.terminated). Reading the clock at
+    # every node costs more than the check is worth, so the searches only
+    # do it every self.poll_nodes nodes, a fraction of a millisecond apart.
+    # The soft limit is for Iterative Deepening: it doesn't start a depth
+    # past self.soft_share of the allotted time, or one that the times of
+    # the previous depths say won't finish before the deadline.
+
+    def out_of_time(self):
+        """True when the search has to stop, looking at the clock only
+        every self.poll_nodes calls.
+        """
+        ctx = self.context
+        ctx.polls_left -= 1
+        if ctx.polls_left > 0:
+            return False
+        ctx.polls_left = self.poll_nodes
+        return self.time_left() < 5
+
+    def next_depth_fits(self, times):
+        """Whether Iterative Deepening should start another depth, times
+        being the seconds the previous ones took.
+        """
+        now = time.time()
+        if now - self.start_time > self.soft_share * (self.deadline - self.start_time):
+            return False
+        if len(times) < 2:
+            return True
+        # the next depth should take times[-1] * growth, but the transposition
+        # table often makes it much faster: only skip it when half won't do
+        growth = times[-1] / times[-2] if times[-2] > 0 else 1
+        return now + times[-1] * max(growth, 1) / 2 < self.deadline - 0.005
+
+    def fallback_move(self):
+        """The move of a depth-1 search, run past the deadline, for when
+        time ran out before any search finished. It takes a few
+        microseconds, well within the 5ms the hard limit leaves.
+        """
+        deadline, self.deadline = self.deadline, float("inf")
+        self.terminated = False
+        try:
+            move, placeholder = self.alphabeta(max_depth=1)
+        finally:
+            self.deadline = deadline
+        return move
+
     def print_tiles(self):
         i=0
         while i < self.size: 
@@ -311,98 +673,322 @@ class Game(object):
 
 
 
-    def ab_max_Value(self, upper_game, move, alpha, beta, maximizing_player, depth, maxdepth):
-        if self.time_left()<5:
-            self.terminated=True
-            return [-1,-1],0
-        game=copy.deepcopy(upper_game)
-        if(move!=[-1,-1]):
+    # The Alpha-Beta functions probe and fill the transposition table self.tt.
+    # Entries are only trusted for cutoffs when they come from a root with the
+    # same number of blocks (self.tt_root), see CatTable.py. Otherwise, their
+    # best move is still searched first. A subtree that never hit maxdepth is
+    # solved and gets an infinite draft.
+    #
+    # With self.pvs, they do a Principal Variation Search: the first move,
+    # which comes from the table and so from the previous iteration's
+    # principal variation, gets the full window, and the others a null window
+    # just to prove that they are no better. Those that turn out better are
+    # searched again with the full window. Values are whole numbers, so a
+    # null window is one wide.
+
+    def ab_max_Value(self, move, alpha, beta, maximizing_player, depth, maxdepth):
+        ctx = self.context
+        if self.out_of_time():
+            ctx.terminated=True
+            return -1,0
+        if(move!=-1):
             maximizing_player=not(maximizing_player)
-            game.apply_move(move,maximizing_player)
-
-        legal_moves = game.valid_moves() #["W","E","SE","SW","NE","NW"]
-        if len(legal_moves)==0 or (depth==maxdepth):
-            if (depth==maxdepth):
-                self.reached_maxdepth = True 
-            return [self.cat_i,self.cat_j], (game.size**2 - depth) * game.utility(legal_moves,maximizing_player)
-        v=float("-inf")
-        vtemp=v
-        best_move=game.target(game.cat_i,game.cat_j,legal_moves[0])
-        for s in legal_moves:
-            s_pos=game.target(game.cat_i,game.cat_j,s)
-
-            vtemp=max(v,self.ab_min_Value(game,s_pos,alpha,beta,maximizing_player,depth+1,maxdepth))
-            
-            if self.terminated:
-                return [-1,-1],0
-            if v<vtemp:
-                v=vtemp
-                best_move=s_pos
-            if v>=beta:
-                return best_move,v
-            alpha=max(alpha,v) 
-        return best_move,v
-
-    def ab_min_Value(self, upper_game, move, alpha, beta, maximizing_player, depth, maxdepth):
-        if self.time_left()<5:
-            self.terminated=True
+            self.make_move(move,maximizing_player)
+        try:
+            stats = ctx.stats
+            if stats is not None:
+                stats.node(depth)
+            position = self.position
+            legal_moves = position.cat_moves()
+            if len(legal_moves)==0 or (depth==maxdepth):
+                if (depth==maxdepth):
+                    ctx.reached_maxdepth = True 
+                if stats is not None:
+                    stats.leaf()
+                return position.cat, (self.size**2 - depth) * self.utility(legal_moves,maximizing_player)
+
+            key, frame = self.table_key(False)
+            entry = self.tt.probe(key)
+            if stats is not None:
+                stats.tt_probe(entry)
+            tt_move = -1
+            if entry is not None:
+                if entry[1]==ctx.tt_root and entry[2]>=maxdepth-depth:
+                    flag, value = entry[3], entry[4]
+                    if flag==EXACT or (flag==LOWER and value>=beta) or (flag==UPPER and value<=alpha):
+                        if entry[2]!=float("inf"):
+                            ctx.reached_maxdepth = True
+                        if stats is not None:
+                            stats.tt_cutoff()
+                        return frame[entry[5]], value
+                tt_move = frame[entry[5]]
+                if tt_move in legal_moves:
+                    legal_moves.remove(tt_move)
+                    legal_moves.insert(0,tt_move)
+            if self.history_ordering:
+                self.order_moves(legal_moves, depth, self.cat_history, tt_move)
+
+            alpha_in = alpha
+            reached_above = ctx.reached_maxdepth
+            ctx.reached_maxdepth = False
+            v=float("-inf")
+            vtemp=v
+            best_move=legal_moves[0]
+            for index, s_pos in enumerate(legal_moves):
+
+                if index>0 and self.pvs and beta>alpha+1:
+                    temp=self.ab_min_Value(s_pos,alpha,alpha+1,maximizing_player,depth+1,maxdepth)
+                    if alpha<temp<beta and not ctx.terminated:
+                        temp=self.ab_min_Value(s_pos,alpha,beta,maximizing_player,depth+1,maxdepth)
+                else:
+                    temp=self.ab_min_Value(s_pos,alpha,beta,maximizing_player,depth+1,maxdepth)
+                vtemp=max(v,temp)
+                
+                if ctx.terminated:
+                    return -1,0
+                if v<vtemp:
+                    v=vtemp
+                    best_move=s_pos
+                if v>=beta:
+                    if stats is not None:
+                        stats.cutoff(index)
+                    if self.history_ordering:
+                        self.good_move(s_pos, depth, maxdepth, self.cat_history)
+                    break
+                alpha=max(alpha,v) 
+
+            draft = maxdepth-depth if ctx.reached_maxdepth else float("inf")
+            self.tt.store(key, ctx.tt_root, draft, bound(v,alpha_in,beta), v, frame[best_move])
+            ctx.reached_maxdepth = ctx.reached_maxdepth or reached_above
+            return best_move,v
+        finally:
+            if(move!=-1):
+                self.undo_move()
+
+    def ab_min_Value(self, move, alpha, beta, maximizing_player, depth, maxdepth):
+        ctx = self.context
+        if self.out_of_time():
+            ctx.terminated=True
             return 0
-        game=copy.deepcopy(upper_game)
         maximizing_player=not(maximizing_player)
-        game.apply_move(move,maximizing_player)
-
-        #legal_moves = game.valid_moves()  # Cat just moved, so he hasn't lost.
-                  # Besides, legal moves are free tiles for the cat's opponent.
-        
-        if (depth==maxdepth) or\
-           (game.cat_i==0 or game.cat_i==self.size-1 or game.cat_j==0 or game.cat_j==self.size-1):
-            if (depth==maxdepth):
-                self.reached_maxdepth = True 
-            return (game.size**2 - depth) * game.utility([2,3,4],maximizing_player)
-
-        v=float("inf")   
-             
-        #for s in legal_moves:
-        for i in range(game.size):      # workaround to avoid book-keeping of valid block moves
-            for j in range(game.size):  #
-                if game.tiles[i][j]!=0: #
-                    continue            #
-                s = [i,j]
+        self.make_move(move,maximizing_player)
+        try:
+            #legal_moves = game.valid_moves()  # Cat just moved, so he hasn't lost.
+                      # Besides, legal moves are free tiles for the cat's opponent.
+            
+            stats = ctx.stats
+            if stats is not None:
+                stats.node(depth)
+            if (depth==maxdepth) or self.position.cat_on_border():
+                if (depth==maxdepth):
+                    ctx.reached_maxdepth = True 
+                if stats is not None:
+                    stats.leaf()
+                return (self.size**2 - depth) * self.utility([2,3,4],maximizing_player)
+
+            tt_move = -1
+            key, frame = self.table_key(True)
+            entry = self.tt.probe(key)
+            if stats is not None:
+                stats.tt_probe(entry)
+            if entry is not None:
+                if entry[1]==ctx.tt_root and entry[2]>=maxdepth-depth:
+                    flag, value = entry[3], entry[4]
+                    if flag==EXACT or (flag==LOWER and value>=beta) or (flag==UPPER and value<=alpha):
+                        if entry[2]!=float("inf"):
+                            ctx.reached_maxdepth = True
+                        if stats is not None:
+                            stats.tt_cutoff()
+                        return value
+                tt_move = frame[entry[5]]
+
+            if depth+1==maxdepth and self.batch_leaves and self.heuristic=="proximity":
+                v, best_move = self.frontier_min_Value(alpha, beta, maximizing_player, depth, maxdepth, tt_move)
+                if ctx.terminated:
+                    return 0
+                draft = 1 if best_move >= 0 else float("inf")
+                ctx.reached_maxdepth = ctx.reached_maxdepth or best_move >= 0
+                self.tt.store(key, ctx.tt_root, draft, bound(v,alpha,beta), v, frame[best_move])
+                return v
+
+            beta_in = beta
+            reached_above = ctx.reached_maxdepth
+            ctx.reached_maxdepth = False
+            v=float("inf")   
+            best_move=-1
+                 
+            #for s in legal_moves:
+            for index, s in enumerate(self.blocker_moves(depth,maxdepth,tt_move)):
                 
-                placeholder,temp=self.ab_max_Value(game,s,alpha,beta,maximizing_player,depth+1,maxdepth)
+                if index>0 and self.pvs and beta>alpha+1:
+                    placeholder,temp=self.ab_max_Value(s,beta-1,beta,maximizing_player,depth+1,maxdepth)
+                    if alpha<temp<beta and not ctx.terminated:
+                        placeholder,temp=self.ab_max_Value(s,alpha,beta,maximizing_player,depth+1,maxdepth)
+                else:
+                    placeholder,temp=self.ab_max_Value(s,alpha,beta,maximizing_player,depth+1,maxdepth)
                 
-                v = min(v,temp)
-                if self.terminated:
+                if temp<v:
+                    v=temp
+                    best_move=s
+                if ctx.terminated:
                     return 0
 
                 if v<=alpha:
-                    return v
+                    if stats is not None:
+                        stats.cutoff(index)
+                    if self.history_ordering:
+                        self.good_move(s, depth, maxdepth, self.block_history)
+                    break
                 beta=min(beta,v)
-        return v
 
+            draft = maxdepth-depth if ctx.reached_maxdepth else float("inf")
+            self.tt.store(key, ctx.tt_root, draft, bound(v,alpha,beta_in), v, frame[best_move])
+            ctx.reached_maxdepth = ctx.reached_maxdepth or reached_above
+            return v
+        finally:
+            self.undo_move()
+
+
+    def frontier_min_Value(self, alpha, beta, maximizing_player, depth, maxdepth, first):
+        """The loop of ab_min_Value one step above maxdepth, where all of the
+        blocker's replies are leaves. The first one is searched as usual,
+        since with good move ordering it often cuts off. The others, if
+        there are at least self.batch_min of them, are scored together by
+        utility_batch, and their minimum is returned even when one of them
+        cuts off: it is still an upper bound, only a tighter one. Returns
+        (v, best move), -1 if the blocker can't move.
+        """
+        ctx = self.context
+        moves = list(self.blocker_moves(depth,maxdepth,first))
+        single = 1 if len(moves)>self.batch_min else len(moves)
+        v = float("inf")
+        best_move = -1
+        cutoff = -1
+        for index in range(single):
+            placeholder, temp = self.ab_max_Value(moves[index],alpha,beta,maximizing_player,depth+1,maxdepth)
+            if ctx.terminated:
+                return 0, -1
+            if temp<v:
+                v, best_move = temp, moves[index]
+            if v<=alpha:
+                cutoff = index
+                break
+        if cutoff<0 and single<len(moves):
+            position = self.position
+            rest = np.array(moves[single:])
+            count = len(rest)
+            boards = np.repeat(position.blocked_board()[None], count, axis=0)
+            boards.reshape(count, -1)[np.arange(count), rest] = True
+            values = (self.size**2 - maxdepth) * self.utility_batch(
+                boards, np.full(count, position.cat), not maximizing_player)
+            stats = ctx.stats
+            if stats is not None:
+                for k in range(count):
+                    stats.node(maxdepth)
+                    stats.leaf()
+            low = values.argmin()
+            if values[low]<v:
+                v, best_move = float(values[low]), moves[single+low]
+            if v<=alpha:
+                cutoff = single + int(np.argmax(values<=alpha))
+                best_move = moves[cutoff]
+        if cutoff>=0:
+            if ctx.stats is not None:
+                ctx.stats.cutoff(cutoff)
+            if self.history_ordering:
+                self.good_move(moves[cutoff], depth, maxdepth, self.block_history)
+        return v, best_move
 
     def alphabeta(self, max_depth=float("inf"), alpha=float("-inf"), beta=float("inf"), maximizing_player=True):
-        best_move, best_val = self.ab_max_Value(self,[-1,-1],alpha,beta,maximizing_player,0,max_depth)
-        return best_move, best_val
+        self.tt_root = bin(self.position.blocked).count("1")
+        if self.stats is not None:
+            self.stats.start_iteration()
+        if self.workers > 1 and not self.smp and max_depth >= 3 and alpha == float("-inf") and beta == float("inf"):
+            from CatParallel import root_split      # CatParallel imports this module
+            best_move, best_val = root_split(self, max_depth, self.workers, self.ybw)
+        else:
+            best_move, best_val = self.ab_max_Value(-1,alpha,beta,maximizing_player,0,max_depth)
+        if self.stats is not None:
+            self.stats.end_iteration(max_depth, not self.terminated)
+        if not self.terminated:
+            self.pv = self.principal_variation(max_depth)
+        return self.ij(best_move), best_val
+
+    def aspiration(self, max_depth, guess):
+        """Alpha-Beta to max_depth in a window around guess, the value of
+        the previous iteration. When the value falls outside, the window is
+        widened on that side and the search done again.
+        """
+        delta = self.size**2            # one point of utility at the root
+        alpha, beta = guess-delta, guess+delta
+        while True:
+            best_move, value = self.alphabeta(max_depth=max_depth, alpha=alpha, beta=beta)
+            if self.terminated or alpha < value < beta:
+                return best_move, value
+            delta *= 4
+            if delta > 200 * self.size**2:     # wider than any value
+                alpha, beta = float("-inf"), float("inf")
+            elif value <= alpha:
+                alpha = value-delta
+            else:
+                beta = value+delta
+
+    def principal_variation(self, max_depth):
+        """The best line found by the last search, as cells, from the
+        transposition table.
+        """
+        position = self.position
+        pv = []
+        maximizing_player = True
+        try:
+            while len(pv) < max_depth:
+                key, frame = self.table_key(not maximizing_player)
+                entry = self.tt.probe(key)
+                if entry is None or entry[5] < 0:
+                    break
+                move = frame[entry[5]]
+                if maximizing_player and move not in position.cat_moves():
+                    break
+                if not maximizing_player and not position.is_free(move):
+                    break
+                self.make_move(move, not maximizing_player)
+                pv.append(move)
+                maximizing_player = not maximizing_player
+        finally:
+            for move in pv:
+                self.undo_move()
+        return pv
 
 
     def iterative_deepening(self,ab):
         self.terminated=False
         best_depth=0
         output_move, utility = [self.cat_i,self.cat_j],0
+        times = []
         for i in range(1,self.size**2):        
+          if not self.next_depth_fits(times):
+            print("No time for depth %d" % i)
+            break
           self.reached_maxdepth = False
-          best_move, utility = self.alphabeta(max_depth=i) if ab else self.minimax(max_depth=i)
+          iteration_start = time.time()
+          if ab and self.pvs and i > 1:
+            best_move, utility = self.aspiration(i, utility)
+          else:
+            best_move, utility = self.alphabeta(max_depth=i) if ab else self.minimax(max_depth=i)
           if self.terminated:
             break
           else:
+            times.append(time.time() - iteration_start)
             output_move = best_move
             best_depth = i
             elapsed_time = (time.time() - self.start_time) * 1000
             print ("Done with a tree of depth %d in %.3fms " % (i,elapsed_time))
+            if self.on_progress is not None:
+              self.on_progress(i, output_move)
             if (self.reached_maxdepth == False): 
               break
         print('Depth reached: ',best_depth)
+        self.depth_reached = best_depth
         return output_move,utility
 
 
@@ -411,7 +997,7 @@ class CatEvalFn():
     """Evaluation function that outputs a score equal to 
     the number of valid moves for the cat."""
     def score_moves(self, game, maximizing_player_turn=True):
-        cat_moves=game.valid_moves()
+        cat_moves=game.position.cat_moves()
         return len(cat_moves) if maximizing_player_turn else len(cat_moves)-1
 
     """Your own Evaluation function."""
@@ -427,23 +1013,58 @@ class CatEvalFn():
     def score_proximity(self, game, maximizing_player_turn=True):
        
         distances=[100,100]
-        cat_moves=game.valid_moves()
-        #cat_moves=["W","E","SE","SW","NE","NW"]
-        for move in cat_moves:
-            dist = 0
-            i,j = game.cat_i,game.cat_j
-            while True:
-                dist = dist + 1
-                i,j = game.target(i,j,move)
-                if (i<0 or i>=game.size or j<0 or j>=game.size):
-                    break
-                if game.tiles[i][j] != 0:
-                    dist = dist*5
-                    break
+        position = game.position
+        cat, blocked, size = position.cat, position.blocked, game.size
+        ray_masks = position.geometry.ray_masks[cat]
+        #rays in the order ["E","W","NE","NW","SE","SW"]
+        for d, ray in enumerate(position.geometry.rays[cat]):
+            if not ray or (blocked >> ray[0]) & 1:
+                continue                                # not a valid move
+            hit = blocked & ray_masks[d]
+            if not hit:
+                dist = len(ray) + 1                     # steps to get off the board
+            else:
+                # the first block on the ray is its lowest cell going E/SE/SW,
+                # its highest going W/NE/NW
+                cell = (hit & -hit).bit_length()-1 if ray[0] > cat else hit.bit_length()-1
+                dist = abs(cell - cat) if d < 2 else abs(cell//size - cat//size)
+                dist = dist*5
             distances.append(dist)
 
         distances.sort() 
         return game.size*2-(distances[0] if maximizing_player_turn else distances[1])
 
 
-
+    """score_proximity of many boards at once: boards is a (batch, size,
+    size) boolean array, True for blocked, and cats the cat cell on each.
+    The first block on each ray is found for all of them together."""
+    def score_proximity_batch(self, game, boards, cats, maximizing_player_turn=True):
+
+        geo = game.position.geometry
+        count = len(cats)
+        flat = np.zeros((count, geo.cells+1), bool)
+        flat[:, :geo.cells] = boards.reshape(count, -1)
+        lengths = geo.ray_lengths[cats]                                 # (batch, 6)
+        hit = flat[np.arange(count)[:, None, None], geo.ray_cells[cats]]  # (batch, 6, size-1)
+        hit &= np.arange(hit.shape[2]) < lengths[:, :, None]
+        dist = np.where(hit.any(axis=2), 5*(hit.argmax(axis=2)+1), lengths+1)
+        dist = np.where((lengths > 0) & ~hit[:, :, 0], dist, 100)         # 100: not a valid move
+        dist.sort(axis=1)
+        return game.size*2 - dist[:, 0 if maximizing_player_turn else 1]
+
+
+    """Evaluation function that outputs a score sensitive to the length
+    of the cat's shortest way out, walking around the blocks, and to the
+    number of exits it has at that length. The distances are kept in an
+    EscapeMap that follows every block placed or removed."""
+    def score_escape(self, game, maximizing_player_turn=True):
+
+        escape = game.position.escape
+        if escape is None:
+            escape = game.position.track_escape()
+        dist, exits = escape.escape_route(game.position.cat)
+        if exits == 0:
+            return game.size*2 - game.size**2   # enclosed: worse than any way out
+        if not maximizing_player_turn and exits == 1:
+            dist = dist + 1                     # the blocker closes the only exit
+        return game.size*2 - dist
@@ -0,0 +1,282 @@
+#
+# Monte Carlo Tree Search for the cats in CatGame.
+#
+# UCT: every simulation walks down the tree from the root, taking the
+# child with the best upper confidence bound (the cat picks its best
+# win rate, the blocker the cat's worst), adds one new node, plays the
+# game out from there with a cheap policy and counts the cat's wins on
+# the way back up. The cat plays the root move simulated most often.
+#
+# The blocker has a move for every free tile, too many to try them all,
+# so its nodes widen progressively: a node visited n times has at most
+# 1 + sqrt(n) children, taken in Game.blocker_moves order (the tiles on
+# the cat's shortest ways out first).
+#
+# The playouts run in batches as NumPy array operations. Each batch picks
+# LEAVES new leaves (each path counts as visited as soon as it is picked,
+# a "virtual loss", so that the next ones spread out), copies the board of
+# each leaf ROLLOUTS times into one boolean array, a row per copy, and
+# plays them all out together: the cat steps towards the border, the
+# blocker mostly blocks the cat's best step.
+#
+# The tree lives in Game.mcts, a MonteCarloTree. When the next search
+# starts from a position two moves down its root, that subtree is reused.
+#
+
+import math
+
+import numpy as np
+
+from CatBoard import geometry
+from CatProof import can_escape
+
+EXPLORATION = 0.7   # UCT constant, for win rates between 0 and 1
+LEAVES = 32         # new leaves per batch
+ROLLOUTS = 8        # playouts per leaf
+GREEDY = 0.8        # how often the playout blocker blocks the cat's best step
+
+
+class Node(object):
+    """A position of the tree. wins counts the cat's wins out of visits."""
+    __slots__ = ("move", "key", "cat_to_move", "children", "untried", "visits", "wins", "result")
+
+    def __init__(self, move, key, cat_to_move):
+        self.move = move                # the cell moved to or blocked to get here
+        self.key = key                  # Zobrist key of the position
+        self.cat_to_move = cat_to_move
+        self.children = []
+        self.untried = []               # moves without a child yet, best first
+        self.visits = 0
+        self.wins = 0.0
+        self.result = None              # 1 or 0 when the cat has won or lost already
+
+
+class Playouts(object):
+    """The arrays the playouts of an NxN board need. Cell index `cells`
+    stands for off the board: it is always blocked.
+    """
+    def __init__(self, size):
+        geo = geometry(size)
+        cells = geo.cells
+        self.cells = cells
+        self.adjacent = np.full((cells+1, 6), cells, np.int32)
+        for cell, adjacent in enumerate(geo.adjacent):
+            self.adjacent[cell, :len(adjacent)] = adjacent
+        self.border = np.zeros(cells+1, bool)
+        self.border[[cell for cell in range(cells) if (geo.border >> cell) & 1]] = True
+        # steps to the border on an empty board
+        self.dist = np.full(cells+1, cells, np.float64)
+        reach, layer, steps = 0, geo.border, 0
+        while layer:
+            for cell in range(cells):
+                if (layer >> cell) & 1:
+                    self.dist[cell] = steps
+            reach |= layer
+            layer = geo.dilate(reach) & ~reach
+            steps += 1
+
+    def run(self, blocked, cats, blocker_first, rng):
+        """Play out boards (a boolean array, a row per board, True for
+        blocked) in place. cats holds the cat cell of each board, and
+        blocker_first says which ones have the blocker to move. Returns
+        a boolean array, True where the cat escaped.
+        """
+        count = len(cats)
+        rows = np.arange(count)
+        won = np.zeros(count, bool)
+        alive = np.ones(count, bool)
+        cats = cats.copy()
+        self.block(blocked, cats, rows, blocker_first, rng)
+        while alive.any():
+            # the cat steps to its free neighbour nearest the border, give or take
+            steps = self.adjacent[cats]
+            free = ~blocked[rows[:, None], steps]
+            stuck = ~free.any(axis=1)
+            alive &= ~stuck
+            score = np.where(free, self.dist[steps] + rng.random(steps.shape), np.inf)
+            moved = steps[rows, score.argmin(axis=1)]
+            cats = np.where(alive, moved, cats)
+            escaped = alive & self.border[cats]
+            won |= escaped
+            alive &= ~escaped
+            self.block(blocked, cats, rows, alive, rng)
+        return won
+
+    def block(self, blocked, cats, rows, which, rng):
+        """The blocker's move on the boards in which: mostly the cat's
+        best step, otherwise another free neighbour of the cat.
+        """
+        steps = self.adjacent[cats]
+        free = ~blocked[rows[:, None], steps]
+        greedy = rng.random(len(cats)) < GREEDY
+        score = np.where(greedy[:, None], self.dist[steps], 0) + rng.random(steps.shape)
+        score = np.where(free, score, np.inf)
+        cell = steps[rows, score.argmin(axis=1)]
+        which = which & free.any(axis=1)
+        blocked[rows[which], cell[which]] = True
+
+
+_playouts = {}
+
+def playouts(size):
+    """Return the (cached) Playouts of an NxN board."""
+    if size not in _playouts:
+        _playouts[size] = Playouts(size)
+    return _playouts[size]
+
+
+def board_row(position):
+    """The blocked cells of position as a boolean array, with the extra
+    off-the-board cell blocked.
+    """
+    cells = position.geometry.cells
+    data = np.frombuffer(position.blocked.to_bytes(cells//8 + 1, "little"), np.uint8)
+    row = np.zeros(cells+1, bool)
+    row[:cells] = np.unpackbits(data, bitorder="little")[:cells]
+    row[cells] = True
+    return row
+
+
+class MonteCarloTree(object):
+    """The search tree of a game, kept from one move to the next."""
+    def __init__(self):
+        self.root = None
+        self.rng = np.random.default_rng()
+
+    def new_root(self, game):
+        """The root for the position of game, reusing the tree when it is
+        a grandchild of the last root.
+        """
+        key = game.position.hash
+        if self.root is not None:
+            for child in self.root.children:
+                for grandchild in child.children:
+                    if grandchild.key == key:
+                        self.root = grandchild
+                        return grandchild
+        self.root = Node(-1, key, True)
+        self.expand(game, self.root, 0)
+        return self.root
+
+    def expand(self, game, node, depth):
+        """Fill in the moves of a new node, or its result."""
+        position = game.position
+        geo = position.geometry
+        if node.cat_to_move:
+            moves = position.cat_moves()
+            if not moves:
+                node.result = 0
+            elif position.free_neighbours() & geo.border:
+                node.result = 1
+            else:
+                dist = playouts(game.size).dist
+                node.untried = sorted(moves, key=dist.__getitem__)
+        elif not can_escape(position):
+            node.result = 0
+        else:
+            exits = geo.border & position.free_neighbours()
+            if exits & (exits - 1):
+                node.result = 1     # two ways out, one block
+            else:
+                node.untried = list(game.blocker_moves(depth, float("inf")))
+                if not node.untried:
+                    node.result = 0
+
+    def select(self, node):
+        """The child of node with the best upper confidence bound."""
+        log_visits = math.log(node.visits)
+        best, best_score = None, float("-inf")
+        for child in node.children:
+            rate = child.wins / child.visits
+            score = (rate if node.cat_to_move else 1-rate) + EXPLORATION * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def descend(self, game, root):
+        """Walk down from root making the moves on game, and add a new node.
+        Returns the path, root first.
+        """
+        node = root
+        path = [node]
+        depth = 0
+        while node.result is None:
+            widen = node.cat_to_move or len(node.children) < 1 + math.sqrt(node.visits)
+            if node.untried and widen:
+                move = node.untried.pop(0)
+                game.make_move(move, not node.cat_to_move)
+                child = Node(move, game.position.hash, not node.cat_to_move)
+                self.expand(game, child, depth+1)
+                node.children.append(child)
+                path.append(child)
+                break
+            node = self.select(node)
+            game.make_move(node.move, not path[-1].cat_to_move)
+            path.append(node)
+            depth += 1
+        return path
+
+    def batch(self, game, root):
+        """Run LEAVES simulations of ROLLOUTS playouts each."""
+        stats = game.stats
+        paths = []
+        rows = []
+        cats = []
+        blocker_first = []
+        for k in range(LEAVES):
+            path = self.descend(game, root)
+            for node in path:
+                node.visits += ROLLOUTS
+            leaf = path[-1]
+            if stats is not None:
+                stats.node(len(path)-1)
+            if leaf.result is None:
+                paths.append(path)
+                rows.append(board_row(game.position))
+                cats.append(game.position.cat)
+                blocker_first.append(not leaf.cat_to_move)
+            else:
+                for node in path:
+                    node.wins += leaf.result * ROLLOUTS
+            for node in path[1:]:
+                game.undo_move()
+        if not paths:
+            return
+        if stats is not None:
+            stats.leaves += len(paths) * ROLLOUTS
+        blocked = np.repeat(np.array(rows), ROLLOUTS, axis=0)
+        won = playouts(game.size).run(blocked, np.repeat(cats, ROLLOUTS),
+                                      np.repeat(blocker_first, ROLLOUTS), self.rng)
+        wins = won.reshape(len(paths), ROLLOUTS).sum(axis=1)
+        for path, w in zip(paths, wins):
+            for node in path:
+                node.wins += w
+
+    def search(self, game):
+        """Search the position of game, cat to move, until its deadline.
+        Returns the cell the cat moves to, the cat's cell if it can't move.
+        """
+        root = self.new_root(game)
+        position = game.position
+        if root.result == 0:
+            return position.cat
+        if root.result == 1:
+            return next(cell for cell in position.cat_moves() if (position.geometry.border >> cell) & 1)
+        stats = game.stats
+        if stats is not None:
+            stats.start_iteration()
+        batch_time = 0
+        while game.time_left() > 5 + batch_time:
+            start = game.time_left()
+            self.batch(game, root)
+            batch_time = start - game.time_left()
+            if all(child.result is not None for child in root.children) and not root.untried:
+                break
+        if stats is not None:
+            stats.end_iteration(float("inf"), True)
+        won = [child for child in root.children if child.result == 1]
+        if won:
+            return won[0].move
+        if not root.children:
+            return root.untried[0]
+        return max(root.children, key=lambda child: child.visits).move
@@ -0,0 +1,292 @@
+#
+# Parallel Alpha-Beta for the cats in CatGame: the root is split across
+# a pool of processes.
+#
+# The cat has at most six moves at the root. Each one is sent to a pool
+# process, which searches the blocker's replies to it one after the other.
+# The best value found so far at the root (alpha) lives in shared memory:
+# the master raises it as root moves come back, and the pool processes
+# read it before every reply, so a root move that can't beat it is dropped
+# early. The deadline is shared the same way, so the master can stop the
+# pool processes when its own time is up or its search is cancelled.
+#
+# With Young Brothers Wait (ybw), the master first searches the eldest
+# root move itself: its first reply sequentially, then its other replies
+# in parallel. The other root moves are sent out once alpha is known.
+#
+# Each pool process keeps its own Game, and so its own transposition
+# table, for every board size it has seen.
+#
+# Lazy SMP (lazy_smp) is the other way to use the pool: every process runs
+# its own Iterative Deepening on the whole position, half of them one depth
+# ahead, and they all share one SharedTranspositionTable. What one of them
+# stores saves work for the others. The master searches too, and takes the
+# deepest result finished by the deadline.
+#
+
+import atexit
+import concurrent.futures
+import multiprocessing
+import time
+from multiprocessing import resource_tracker
+
+from CatBoard import Position
+from CatGame import Game
+from CatTable import EXACT, SharedTranspositionTable
+
+_pool = None
+_pool_workers = 0
+_alpha = None       # best value at the root so far
+_deadline = None    # the deadline of the pool processes, 0 to stop them
+_games = {}         # size -> _WorkerGame, in each pool process
+_shared_tt = None   # the SharedTranspositionTable of lazy_smp
+_tables = {}        # name -> that table, attached in each pool process
+
+# The Game settings the pool processes search with, sent along with every task.
+SETTINGS = ("heuristic", "full_scan", "symmetry", "history_ordering", "pvs",
+            "batch_leaves", "batch_min", "poll_nodes")
+
+
+def _settings(game):
+    return tuple(getattr(game, name) for name in SETTINGS)
+
+
+def _init_worker(alpha, deadline):
+    global _alpha, _deadline
+    _alpha = alpha
+    _deadline = deadline
+
+
+def get_pool(workers):
+    """Return the process pool, (re)starting it with that many workers."""
+    global _pool, _pool_workers, _alpha, _deadline
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        # the pool processes inherit the master's resource tracker, instead of
+        # each starting its own that unlinks the SharedTranspositionTable when
+        # the process exits
+        resource_tracker.ensure_running()
+        _alpha = multiprocessing.RawValue("d", float("-inf"))
+        _deadline = multiprocessing.RawValue("d", 0.0)
+        _pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                       initargs=(_alpha, _deadline))
+        _pool_workers = workers
+    return _pool
+
+
+class _WorkerGame(Game):
+    """The game a pool process searches on, with the shared deadline."""
+    def time_left(self):
+        return (_deadline.value - time.time()) * 1000
+
+
+def _worker_game(size, blocked, cat, settings):
+    """The game of this pool process for an NxN board, set up on a
+    position with the master's settings.
+    """
+    game = _games.get(size)
+    if game is None:
+        game = _games[size] = _WorkerGame(size)
+    game.position = Position(size, blocked, cat)
+    game.undo_stack = []
+    for name, value in zip(SETTINGS, settings):
+        setattr(game, name, value)
+    game.terminated = False
+    return game
+
+
+def _search(task):
+    """Search one task in a pool process.
+    task is (size, blocked, cat, tt_root, settings, maxdepth, cat_move,
+    block, alpha, beta), settings being the master's SETTINGS. With
+    block = -1, this is the cat's root move cat_move; otherwise it's the
+    blocker's reply block to it. Returns (value, reached_maxdepth), or
+    None when time ran out.
+    """
+    size, blocked, cat, tt_root, settings, maxdepth, cat_move, block, alpha, beta = task
+    game = _worker_game(size, blocked, cat, settings)
+    position = game.position
+    game.tt_root = tt_root
+    game.reached_maxdepth = False
+
+    game.make_move(cat_move, False)
+    try:
+        if block >= 0:
+            placeholder, v = game.ab_max_Value(block, alpha, beta, False, 2, maxdepth)
+        elif position.cat_on_border():
+            v = (size**2 - 1) * game.utility([2,3,4], False)
+        else:
+            v = float("inf")
+            for s in game.blocker_moves(1, maxdepth):
+                alpha = max(alpha, _alpha.value)
+                placeholder, temp = game.ab_max_Value(s, alpha, min(beta, v), False, 2, maxdepth)
+                if game.terminated:
+                    break
+                v = min(v, temp)
+                if v <= alpha:
+                    break
+        if game.terminated:
+            return None
+        return v, game.reached_maxdepth
+    finally:
+        game.undo_move()
+
+
+def _gather(game, futures, on_result):
+    """Wait for the futures, calling on_result(key, value) as each one is
+    done. Returns False if the master's time ran out first.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=0.01,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if result is None:          # the pool's time ran out
+                game.terminated = True
+                continue
+            value, reached = result
+            game.reached_maxdepth = game.reached_maxdepth or reached
+            on_result(futures[future], value)
+        if game.terminated or game.time_left() < 5:
+            _deadline.value = 0
+            for future in pending:
+                future.cancel()
+            concurrent.futures.wait(pending)
+            game.terminated = True
+            return False
+    return True
+
+
+def root_split(game, maxdepth, workers, ybw=False):
+    """Alpha-Beta from the root of game, to maxdepth, on a pool of that
+    many processes. Returns (best move, value) like Game.ab_max_Value.
+    """
+    position = game.position
+    moves = position.cat_moves()
+    if not moves:
+        return game.ab_max_Value(-1, float("-inf"), float("inf"), True, 0, maxdepth)
+    key, frame = game.table_key(False)
+    entry = game.tt.probe(key)
+    if entry is not None and frame[entry[5]] in moves:
+        moves.remove(frame[entry[5]])
+        moves.insert(0, frame[entry[5]])
+
+    pool = get_pool(workers)
+    _deadline.value = game.deadline
+    _alpha.value = float("-inf")
+    task = (game.size, position.blocked, position.cat, game.tt_root,
+            _settings(game), maxdepth)
+    best = [moves[0], float("-inf")]
+
+    def root_result(move, value):
+        if value > best[1]:
+            best[0], best[1] = move, value
+            _alpha.value = value
+
+    if ybw:
+        eldest = moves.pop(0)
+        game.make_move(eldest, False)
+        try:
+            on_border = position.cat_on_border()
+            replies = [] if on_border else list(game.blocker_moves(1, maxdepth))
+        finally:
+            game.undo_move()
+        if on_border or len(replies) < 2:
+            value = game.ab_min_Value(eldest, float("-inf"), float("inf"), True, 1, maxdepth)
+        else:
+            # the first reply here, the others on the pool, under its value
+            game.make_move(eldest, False)
+            try:
+                placeholder, first = game.ab_max_Value(replies[0], float("-inf"), float("inf"), False, 2, maxdepth)
+            finally:
+                game.undo_move()
+            value = [first]
+            def reply_result(block, v):
+                value[0] = min(value[0], v)
+            if not game.terminated:
+                futures = {pool.submit(_search, task + (eldest, block, float("-inf"), first)): block
+                           for block in replies[1:]}
+                _gather(game, futures, reply_result)
+            value = value[0]
+        if game.terminated:
+            return -1, 0
+        root_result(eldest, value)
+
+    futures = {pool.submit(_search, task + (move, -1, best[1], float("inf"))): move for move in moves}
+    if not _gather(game, futures, root_result):
+        return -1, 0
+    # for the move ordering of the next iteration
+    draft = maxdepth if game.reached_maxdepth else float("inf")
+    game.tt.store(key, game.tt_root, draft, EXACT, best[1], frame[best[0]])
+    return best[0], best[1]
+
+
+def shared_table():
+    """Return the SharedTranspositionTable of Lazy SMP, creating it once."""
+    global _shared_tt
+    if _shared_tt is None:
+        _shared_tt = SharedTranspositionTable(bits=20)
+        atexit.register(_shared_tt.close)
+    return _shared_tt
+
+
+def _deepen(game, first_depth):
+    """Iterative Deepening from first_depth on. Returns the deepest
+    (depth, move, value) it finished, depth 0 if none.
+    """
+    best = (0, game.ij(game.position.cat), 0)
+    for depth in range(first_depth, game.size**2):
+        game.reached_maxdepth = False
+        move, value = game.alphabeta(max_depth=depth)
+        if game.terminated:
+            break
+        best = (depth, move, value)
+        if not game.reached_maxdepth:
+            break
+    return best
+
+
+def _helper(task):
+    """One Lazy SMP helper, in a pool process.
+    task is (size, blocked, cat, settings, bits, name, first_depth).
+    """
+    size, blocked, cat, settings, bits, name, first_depth = task
+    table = _tables.get(name)
+    if table is None:
+        table = _tables[name] = SharedTranspositionTable(bits, name)
+    game = _worker_game(size, blocked, cat, settings)
+    own_tt, game.tt = game.tt, table
+    try:
+        return _deepen(game, first_depth)
+    finally:
+        game.tt = own_tt
+
+
+def lazy_smp(game, workers):
+    """Iterative Deepening from the root of game on the master and
+    workers-1 pool processes, sharing a transposition table, until the
+    game's deadline. Returns ([i,j] move, value) of the deepest search any
+    of them finished, and sets game.depth_reached.
+    """
+    table = shared_table()
+    position = game.position
+    pool = get_pool(workers - 1)
+    _deadline.value = game.deadline
+    task = (game.size, position.blocked, position.cat, _settings(game),
+            table.bits, table.name)
+    futures = [pool.submit(_helper, task + (1 + k % 2,)) for k in range(1, workers)]
+
+    game.terminated = False
+    own_tt, game.tt = game.tt, table
+    try:
+        results = [_deepen(game, 1)]
+    finally:
+        game.tt = own_tt
+        _deadline.value = 0     # the master is done: time's up, or the game is solved
+    results += [future.result() for future in futures]
+    depth, move, value = max(results, key=lambda result: result[0])
+    game.depth_reached = depth
+    print('Depth reached: ', depth)
+    return move, value
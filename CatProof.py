@@ -0,0 +1,187 @@
+#
+# Proof-number search for the cats in CatGame: prove that the cat escapes,
+# or that it is trapped, whatever the other side does.
+#
+# This is depth-first proof-number search (df-pn). Every position gets a
+# proof number, the least number of leaves that must still be shown to be
+# cat wins for the position to be one, and a disproof number, the same
+# for a blocker win. The cat's positions (OR nodes) take the smallest
+# proof number of their children and the sum of their disproof numbers;
+# the blocker's positions (AND nodes) the other way round. The search
+# always goes down the most proving child, and stays below it until its
+# numbers cross thresholds that make a sibling more promising. Proofs
+# come much faster than from Alpha-Beta when the position is tactical:
+# the search goes straight to the forcing lines and doesn't need a depth.
+#
+# The moves are the same as in Alpha-Beta: Position.cat_moves for the cat
+# and Game.blocker_moves, with no depth limit, for the blocker. The
+# numbers live in Game.proof_table, by Game.table_key (a position and its
+# mirror image share an entry), and are kept between moves: proofs and
+# disproofs hold for the rest of the game.
+#
+# A search stops when it has visited max_nodes positions or when its
+# deadline passes, checked every Game.poll_nodes positions. The table is
+# pruned to the solved positions when it grows over max_entries.
+#
+
+import time
+
+INF = 1 << 30       # the proof number of a disproved position, and so on
+
+
+def can_escape(position):
+    """True if the cat has a way to the border through free cells."""
+    geo = position.geometry
+    free = geo.full & ~position.blocked
+    reach = 1 << position.cat
+    while not reach & geo.border:
+        grown = geo.dilate(reach) & free & ~reach
+        if not grown:
+            return False
+        reach |= grown
+    return True
+
+
+class ProofSearch(object):
+    """One df-pn search from the position of game, cat to move."""
+    def __init__(self, game, max_nodes, max_entries, deadline):
+        self.game = game
+        self.table = game.proof_table
+        self.max_nodes = max_nodes
+        self.max_entries = max_entries
+        self.deadline = min(deadline, game.deadline)
+        self.nodes = 0
+        self.stopped = False
+
+    def run(self):
+        """Return (result, cell): result is True if the cat escapes, with
+        cell a winning move, False if it is trapped, and None if the
+        search ran out of nodes or time first (cell is then -1).
+        """
+        game = self.game
+        stats = game.stats
+        if stats is not None:
+            stats.start_iteration()
+        self.mid(True, 0, INF, INF)
+        pn, dn = self.lookup(game.table_key(False)[0])
+        if stats is not None:
+            stats.end_iteration(float("inf"), pn == 0 or dn == 0)
+        if pn == 0:
+            return True, self.winning_move()
+        if dn == 0:
+            return False, -1
+        return None, -1
+
+    def lookup(self, key):
+        return self.table.get(key, (1, 1))
+
+    def store(self, key, pn, dn):
+        table = self.table
+        table[key] = (pn, dn)
+        if len(table) > self.max_entries:
+            for k in [k for k, (p, d) in table.items() if p and d]:
+                del table[k]
+            if len(table) > self.max_entries // 2:
+                table.clear()
+
+    def winning_move(self):
+        """A cat move to a proved position."""
+        position = self.game.position
+        geo = position.geometry
+        moves = position.cat_moves()
+        for cell, key in zip(moves, self.child_keys(moves, True)):
+            if (geo.border >> cell) & 1 or self.lookup(key)[0] == 0:
+                return cell
+        return -1
+
+    def child_keys(self, moves, cat_to_move):
+        """The table keys of the positions after each of moves, without
+        making them.
+        """
+        position = self.game.position
+        geo = position.geometry
+        key, mirrored_key = position.hash, position.mirror_hash
+        if cat_to_move:
+            key ^= geo.zobrist_cat[position.cat] ^ geo.zobrist_blocker
+            mirrored_key ^= geo.zobrist_mirror_cat[position.cat] ^ geo.zobrist_blocker
+            zobrist, mirrored = geo.zobrist_cat, geo.zobrist_mirror_cat
+        else:
+            zobrist, mirrored = geo.zobrist_block, geo.zobrist_mirror_block
+        if not self.game.symmetry:
+            return [key ^ zobrist[cell] for cell in moves]
+        return [min(key ^ zobrist[cell], mirrored_key ^ mirrored[cell]) for cell in moves]
+
+    def children(self, cat_to_move, depth):
+        """Return (moves, keys) of the children of the current position, or
+        (pn, dn) when it is decided without them.
+        """
+        game = self.game
+        position = game.position
+        geo = position.geometry
+        if cat_to_move:
+            moves = position.cat_moves()
+            if not moves:
+                return INF, 0
+            if position.free_neighbours() & geo.border:
+                return 0, INF
+            return moves, self.child_keys(moves, True)
+        if not can_escape(position):
+            return INF, 0
+        exits = geo.border & position.free_neighbours()
+        if exits & (exits - 1):
+            return 0, INF       # two ways out, one block
+        moves = list(game.blocker_moves(depth, float("inf")))
+        if not moves:
+            return INF, 0
+        return moves, self.child_keys(moves, False)
+
+    def mid(self, cat_to_move, depth, thpn, thdn):
+        """Search the current position until its proof number reaches thpn
+        or its disproof number thdn, and store its numbers.
+        """
+        game = self.game
+        self.nodes += 1
+        if game.stats is not None:
+            game.stats.node(depth)
+        if self.nodes > self.max_nodes or (self.nodes % game.poll_nodes == 0 and
+                                           (time.time() > self.deadline or game.time_left() < 5)):
+            self.stopped = True
+            return
+        key = game.table_key(not cat_to_move)[0]
+        found = self.children(cat_to_move, depth)
+        if isinstance(found[0], int):
+            self.store(key, *found)
+            return
+        moves, keys = found
+
+        while True:
+            numbers = [self.lookup(k) for k in keys]
+            # "mine" is the number this side minimizes: the proof number for the cat
+            mine = [n[0] if cat_to_move else n[1] for n in numbers]
+            theirs = [n[1] if cat_to_move else n[0] for n in numbers]
+            best = min(range(len(moves)), key=mine.__getitem__)
+            low = mine[best]
+            total = INF if low == 0 else min(sum(theirs), INF-1)
+            pn, dn = (low, total) if cat_to_move else (total, low)
+            if pn >= thpn or dn >= thdn or self.stopped:
+                break
+            second = min((m for k, m in enumerate(mine) if k != best), default=INF)
+            th_mine, th_theirs = (thpn, thdn) if cat_to_move else (thdn, thpn)
+            child_mine = min(th_mine, second+1)
+            child_theirs = min(th_theirs - total + theirs[best], INF)
+            child = (child_mine, child_theirs) if cat_to_move else (child_theirs, child_mine)
+            game.make_move(moves[best], not cat_to_move)
+            try:
+                self.mid(not cat_to_move, depth+1, *child)
+            finally:
+                game.undo_move()
+        self.store(key, pn, dn)
+
+
+def prove(game, max_nodes, max_entries, deadline):
+    """df-pn from the position of game, cat to move. Returns (result, cell,
+    nodes) with result and cell as in ProofSearch.run.
+    """
+    search = ProofSearch(game, max_nodes, max_entries, deadline)
+    result, cell = search.run()
+    return result, cell, search.nodes
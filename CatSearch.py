@@ -0,0 +1,47 @@
+#
+# The state of a search in CatGame, apart from the board.
+#
+# A Game holds the position (a CatBoard.Position), its settings and the
+# tables it keeps for the whole game. What only lives as long as one
+# CustomCat call -- the clock, the flags the search functions raise and
+# the statistics -- is in a SearchContext, Game.context. Game keeps its
+# old attributes (game.deadline, game.terminated, ...) as properties on
+# top of it, while the search functions use the context directly.
+#
+
+import time
+
+
+class SearchContext(object):
+    """Timing, flags and statistics of the search in progress.
+
+    deadline         -- time.time() by which the search must be done
+    start_time       -- when it started
+    terminated       -- set when the search stopped because time was up
+    reached_maxdepth -- set when the search was cut short by its depth limit
+    polls_left       -- nodes until the next look at the clock
+    tt_root          -- number of blocks at the root, see CatTable.py
+    stats            -- a SearchStats, None when not collecting them
+    cancelled        -- set by Game.cancel
+    """
+    __slots__ = ("deadline", "start_time", "terminated", "reached_maxdepth",
+                 "polls_left", "tt_root", "stats", "cancelled")
+
+    def __init__(self):
+        self.deadline = 0
+        self.start_time = time.time()
+        self.terminated = False
+        self.reached_maxdepth = False
+        self.polls_left = 0
+        self.tt_root = 0
+        self.stats = None
+        self.cancelled = False
+
+
+def in_context(name):
+    """A Game attribute kept in its SearchContext."""
+    def get(game):
+        return getattr(game.context, name)
+    def set(game, value):
+        setattr(game.context, name, value)
+    return property(get, set, doc="Game.context.%s, see CatSearch.py" % name)
@@ -0,0 +1,219 @@
+"""
+Retrograde solver for small Cat Trap boards.
+
+Every round the blocker adds a block, so a position can only lead to
+positions with more blocks. Solving the boards with N blocks from those
+with N+1, from the full board down to the empty one, gives the exact
+result of every position with the cat to move: who wins with perfect
+play, and in how many cat moves.
+
+Usage:
+    python CatSolver.py [N]
+
+writes CatSolved_NxN.db (N defaults to 5) next to this file.
+
+The table has one byte per (cat tile, set of blocks) with the cat to move
+and off the border. A position and its mirror image (see
+CatBoard.BoardGeometry.mirror) have the same result, so only the cat
+tiles in the top half of the board are stored. A 5x5 board has 6 such
+tiles and 2^24 sets of blocks besides the cat's tile, so the file is
+101 MB. It takes about a minute and a half and 600 MB of memory to
+build. A 7x7 board would have 25 * 2^48 positions, far too many to
+solve this way, so only 5x5 (and 3x3) are supported.
+
+File layout, little-endian:
+    magic   5 bytes, b"CATDB"
+    version 1 byte, VERSION
+    size    1 byte, N
+    count   1 byte, the number of cat tiles stored
+    table   count x 2^(N*N-1) bytes. Row k is for the k-th stored tile in
+            raster order, and is indexed by the blocked cells with the
+            cat's own bit taken out (see SolvedBoard.index).
+
+A byte g is a result with the cat to move:
+    g >= 128 -- the cat wins in 255-g moves
+    g <  128 -- the blocker wins after g more cat moves
+so the higher, the better for the cat.
+"""
+
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from CatBoard import geometry
+
+MAGIC = b"CATDB"
+VERSION = 2
+HEADER = struct.Struct("<5sBBB")
+MAX_SIZE = 5
+
+WIN_NOW = 254       # the cat steps on the border
+
+
+def filename(size):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "CatSolved_%dx%d.db" % (size, size))
+
+
+def after_cat_move(g):
+    """The result one cat move earlier: a win one move further away, or a
+    loss one move later.
+    """
+    return np.where(g >= 128, g - 1, g + 1).astype(np.uint8)
+
+
+def popcounts(bits):
+    """Number of set bits of every integer below 2^bits."""
+    counts = np.zeros(1 << bits, np.uint8)
+    for k in range(bits):
+        counts[1 << k : 2 << k] = counts[: 1 << k] + 1
+    return counts
+
+
+def solve(size):
+    """Return the table of results, interior cells x 2^(size*size) block
+    sets. Entries for block sets that hold the cat's cell are meaningless.
+    """
+    if size > MAX_SIZE:
+        raise ValueError("Boards larger than %dx%d are too big to solve" % (MAX_SIZE, MAX_SIZE))
+    geo = geometry(size)
+    cells = geo.cells
+    interior = [cell for cell in range(cells) if not (geo.border >> cell) & 1]
+    row = {cell: k for k, cell in enumerate(interior)}
+    value = np.zeros((len(interior), 1 << cells), np.uint8)
+    counts = popcounts(cells)
+
+    for blocks in range(cells-1, -1, -1):
+        layer = np.flatnonzero(counts == blocks).astype(np.uint32)
+
+        # blocker to move, cat on n: the blocker picks the worst block for the cat
+        reply = {}
+        for n in interior:
+            worst = np.full(len(layer), 255, np.uint8)
+            for b in range(cells):
+                if b == n:
+                    continue
+                bit = np.uint32(1 << b)
+                free = (layer & bit) == 0
+                worst = np.minimum(worst, np.where(free, value[row[n]][layer | bit], 255))
+            worst[layer == (geo.full ^ (1 << n))] = 0      # nothing left to block: trapped
+            reply[n] = after_cat_move(worst)
+
+        # cat to move on c: the cat picks its best move
+        for c in interior:
+            best = np.zeros(len(layer), np.uint8)
+            for n in geo.adjacent[c]:
+                free = (layer & np.uint32(1 << n)) == 0
+                g = WIN_NOW if (geo.border >> n) & 1 else reply[n]
+                best = np.maximum(best, np.where(free, g, 0))
+            value[row[c]][layer] = best
+        print("%2d blocks: %8d block sets" % (blocks, len(layer)))
+    return interior, value
+
+
+def stored_tiles(geo, interior):
+    """The cat tiles the file has a row for: the ones that come before
+    their mirror image (or are their own).
+    """
+    return [cell for cell in interior if cell <= geo.mirror[cell]]
+
+
+def write(size, interior, value, name):
+    cells = size*size
+    stored = stored_tiles(geometry(size), interior)
+    with open(name, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, size, len(stored)))
+        index = np.arange(1 << (cells-1), dtype=np.uint32)
+        for cat in stored:
+            k = interior.index(cat)
+            low = index & np.uint32((1 << cat) - 1)
+            blocked = low | ((index ^ low) << np.uint32(1))     # put the cat's bit back, clear
+            f.write(value[k][blocked].tobytes())
+
+
+class SolvedBoard(object):
+    """A solved-position file, memory-mapped."""
+    def __init__(self, name):
+        with open(name, "rb") as f:
+            magic, version, size, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d solved-position file" % (name, VERSION))
+        self.size = size
+        self.geometry = geo = geometry(size)
+        self.interior = [cell for cell in range(geo.cells) if not (geo.border >> cell) & 1]
+        stored = stored_tiles(geo, self.interior)
+        if len(stored) != count:
+            raise ValueError("%s doesn't match a %dx%d board" % (name, size, size))
+        self.row = {cell: k for k, cell in enumerate(stored)}
+        self.table = np.memmap(name, np.uint8, mode="r", offset=HEADER.size,
+                               shape=(count, 1 << (geo.cells-1)))
+
+    @staticmethod
+    def index(blocked, cat):
+        """The blocked cells without the cat's bit."""
+        low = blocked & ((1 << cat) - 1)
+        return low | ((blocked >> (cat+1)) << cat)
+
+    def covers(self, position):
+        return position.size == self.size and position.cat in self.interior
+
+    def result(self, blocked, cat):
+        """The result with the cat to move, as a byte (see the top of the file)."""
+        if cat not in self.row:
+            geo = self.geometry
+            blocked, cat = geo.mirror_mask(blocked), geo.mirror[cat]
+        return int(self.table[self.row[cat], self.index(blocked, cat)])
+
+    def best_move(self, position):
+        """Return (cell, result) of the cat's best move, cell -1 if it has none."""
+        geo = self.geometry
+        blocked = position.blocked
+        best, best_g = -1, 0
+        for n in position.cat_moves():
+            if (geo.border >> n) & 1:
+                g = WIN_NOW
+            else:
+                free = [b for b in range(geo.cells) if b != n and not (blocked >> b) & 1]
+                worst = min((self.result(blocked | (1 << b), n) for b in free), default=0)
+                g = worst - 1 if worst >= 128 else worst + 1
+            if g > best_g or best < 0:
+                best, best_g = n, g
+        return best, best_g
+
+    @staticmethod
+    def describe(g):
+        if g >= 128:
+            return "the cat wins in %d moves" % (255 - g)
+        return "the blocker wins after %d cat moves" % g
+
+
+_boards = {}
+
+def solved_board(size):
+    """Return the SolvedBoard of an NxN board, or None if it wasn't built
+    or can't be read (a file from an older version, say).
+    """
+    if size not in _boards:
+        name = filename(size)
+        board = None
+        if size <= MAX_SIZE and os.path.exists(name):
+            try:
+                board = SolvedBoard(name)
+            except (ValueError, struct.error) as error:
+                print("Warning: %s, playing without it. Rebuild it with python CatSolver.py %d" % (error, size))
+        _boards[size] = board
+    return _boards[size]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    start = time.time()
+    interior, value = solve(size)
+    write(size, interior, value, filename(size))
+    print("Wrote %s in %.1fs" % (filename(size), time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
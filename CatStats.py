@@ -0,0 +1,131 @@
+#
+# Search statistics for the cats in CatGame.
+#
+# Set Game.collect_stats and every CustomCat call fills a fresh SearchStats
+# in Game.stats. With Game.stats_log set to a file name, each one is also
+# appended to that file as a line of JSON. When collect_stats is off,
+# Game.stats is None and the search functions skip all the counting.
+#
+
+import json
+import time
+
+
+class SearchStats(object):
+    """Counters of one CustomCat call.
+
+    nodes[d]     -- nodes visited at depth d (the root is depth 0)
+    leaves       -- positions scored by Game.utility
+    cutoffs      -- alpha and beta cutoffs
+    cutoff_index -- cutoff_index[k]: cutoffs made by the k-th move tried,
+                    a measure of the move ordering (the more at 0 the better)
+    tt_probes    -- transposition table lookups
+    tt_hits      -- lookups that found an entry
+    tt_cutoffs   -- lookups whose entry was good enough to return from
+    iterations   -- one dict per minimax/alphabeta call: the depth, the
+                    nodes, the seconds it took and whether it finished
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.nodes = []
+        self.leaves = 0
+        self.cutoffs = 0
+        self.cutoff_index = []
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.iterations = []
+        self.seconds = None
+        self._iteration_start = None
+
+    def node(self, depth):
+        nodes = self.nodes
+        if depth < len(nodes):
+            nodes[depth] += 1
+        else:
+            nodes.extend([0] * (depth - len(nodes)))
+            nodes.append(1)
+
+    def leaf(self):
+        self.leaves += 1
+
+    def cutoff(self, index):
+        self.cutoffs += 1
+        counts = self.cutoff_index
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+
+    def tt_probe(self, entry):
+        self.tt_probes += 1
+        if entry is not None:
+            self.tt_hits += 1
+
+    def tt_cutoff(self):
+        self.tt_cutoffs += 1
+
+    def start_iteration(self):
+        self._iteration_start = (time.time(), self.total_nodes())
+
+    def end_iteration(self, depth, finished):
+        """depth is the search's max_depth, inf (stored as None) for no limit."""
+        start, nodes = self._iteration_start
+        self.iterations.append(dict(depth=depth if depth != float("inf") else None,
+                                    nodes=self.total_nodes() - nodes,
+                                    seconds=time.time() - start,
+                                    finished=finished))
+
+    def finish(self):
+        self.seconds = time.time() - self.start_time
+
+    def total_nodes(self):
+        return sum(self.nodes)
+
+    def branching_factor(self):
+        """Effective branching factor of the deepest finished iteration:
+        the b for which b + b^2 + ... + b^d is the number of nodes it
+        searched below the root, d being its depth. None if unknown.
+        """
+        done = [it for it in self.iterations if it["finished"] and it["nodes"] > 1]
+        if not done:
+            return None
+        it = done[-1]
+        depth = len(self.nodes) - 1
+        if it["depth"] is not None:
+            depth = min(depth, it["depth"])
+        target = it["nodes"] - 1
+        if depth < 1 or target < 1:
+            return None
+        low, high = 0.0, float(target)
+        for k in range(50):
+            b = (low + high) / 2
+            if sum(b**n for n in range(1, depth+1)) < target:
+                low = b
+            else:
+                high = b
+        return (low + high) / 2
+
+    def as_dict(self):
+        elapsed = self.seconds if self.seconds is not None else time.time() - self.start_time
+        total = self.total_nodes()
+        return dict(nodes=total,
+                    nodes_per_depth=self.nodes,
+                    leaves=self.leaves,
+                    cutoffs=self.cutoffs,
+                    cutoff_index=self.cutoff_index,
+                    first_move_cutoffs=self.cutoff_index[0] / self.cutoffs if self.cutoffs else None,
+                    tt_probes=self.tt_probes,
+                    tt_hits=self.tt_hits,
+                    tt_hit_rate=self.tt_hits / self.tt_probes if self.tt_probes else None,
+                    tt_cutoffs=self.tt_cutoffs,
+                    branching_factor=self.branching_factor(),
+                    iterations=self.iterations,
+                    seconds=elapsed,
+                    nodes_per_sec=total / elapsed if elapsed > 0 else None)
+
+    def log(self, filename, **extra):
+        """Append the stats, and any extra fields, to a JSONL file."""
+        record = dict(extra)
+        record.update(self.as_dict())
+        with open(filename, "a") as f:
+            f.write(json.dumps(record) + "\n")
@@ -0,0 +1,140 @@
+#
+# Transposition table for the Alpha-Beta search in CatGame.
+#
+# Positions are keyed by the Zobrist hash kept in CatBoard.Position.
+# The table has a fixed number of slots, and each slot holds one entry:
+#
+#     (key, root, draft, flag, value, move)
+#
+#   key   -- full Zobrist key, to tell apart positions sharing a slot
+#   root  -- number of blocks on the board at the root of the search that
+#            stored the entry. Values are scaled by the depth from the root,
+#            so they can only be reused from a root with the same block count.
+#            The move is good for move ordering whatever the root.
+#   draft -- remaining depth below the entry, inf if the subtree was solved
+#   flag  -- EXACT, LOWER or UPPER bound
+#   value -- the value found
+#   move  -- the best move found, as a cell index
+#
+# SharedTranspositionTable has the same interface, but keeps its entries
+# in shared memory, where several processes can use it at once.
+#
+
+from multiprocessing import shared_memory
+import numpy as np
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+def bound(value, alpha, beta):
+    """The kind of bound a fail-soft search over (alpha, beta) returned."""
+    if value <= alpha:
+        return UPPER
+    if value >= beta:
+        return LOWER
+    return EXACT
+
+
+class TranspositionTable(object):
+    """Fixed-size, depth-preferred transposition table."""
+    def __init__(self, bits=18):
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+
+    def probe(self, key):
+        """Return the entry stored for key, or None."""
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, root, draft, flag, value, move):
+        """Store an entry unless its slot holds a deeper one from the same root."""
+        index = key & self.mask
+        old = self.entries[index]
+        if old is None or old[1] != root or draft >= old[2]:
+            self.entries[index] = (key, root, draft, flag, value, move)
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+
+# Layout of a SharedTranspositionTable slot. data packs everything but the
+# value: root in bits 0-15, draft in bits 16-31 (INF_DRAFT for inf), the
+# flag in bits 32-33, move+1 in bits 34-49 and a used bit in bit 63.
+SLOT = np.dtype([("check", "<u8"), ("data", "<u8"), ("value", "<f8")])
+INF_DRAFT = 0xFFFF
+USED = 1 << 63
+
+
+class SharedTranspositionTable(object):
+    """Fixed-size, depth-preferred transposition table in shared memory.
+    The slots are a numpy structured array (entries) over a
+    multiprocessing.shared_memory block, and are read and written without
+    locks: a slot's check word is its key xor-ed with its other two words,
+    so an entry torn by two processes writing at once doesn't match any key
+    and reads as empty.
+
+    The process that creates the table (name=None) owns it and unlinks it
+    in close(). Other processes attach to it by its bits and name; they
+    must share the owner's resource tracker (start it before them, see
+    CatParallel.get_pool), or theirs unlinks the table when they exit.
+    """
+    def __init__(self, bits=18, name=None):
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.size * SLOT.itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.entries = np.ndarray(self.size, dtype=SLOT, buffer=self.shm.buf)
+        if self.owner:
+            self.entries.fill(0)
+        # the same memory as 64-bit words, for fast access from Python
+        self.words = self.shm.buf.cast("Q")
+        self.floats = self.shm.buf.cast("d")
+
+    def probe(self, key):
+        """Return the entry stored for key, or None."""
+        words = self.words
+        k = 3 * (key & self.mask)
+        check, data, value = words[k], words[k+1], words[k+2]
+        if not data & USED or check ^ data ^ value != key:
+            return None
+        draft = (data >> 16) & 0xFFFF
+        return (key, data & 0xFFFF, float("inf") if draft == INF_DRAFT else draft,
+                (data >> 32) & 3, self.floats[k+2], ((data >> 34) & 0xFFFF) - 1)
+
+    def store(self, key, root, draft, flag, value, move):
+        """Store an entry unless its slot holds a deeper one from the same root."""
+        words = self.words
+        k = 3 * (key & self.mask)
+        old = words[k+1]
+        if old & USED and old & 0xFFFF == root and draft < ((old >> 16) & 0xFFFF):
+            return
+        draft = INF_DRAFT if draft == float("inf") else min(int(draft), INF_DRAFT-1)
+        data = USED | root | draft << 16 | flag << 32 | (move+1) << 34
+        self.floats[k+2] = value
+        words[k+1] = data
+        words[k] = key ^ data ^ words[k+2]
+
+    def clear(self):
+        self.entries.fill(0)
+
+    def close(self):
+        """Detach from the table, and free it if this process owns it."""
+        del self.entries
+        self.words.release()
+        self.floats.release()
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass            # already gone with the processes that shared it
@@ -0,0 +1,182 @@
+"""
+Headless Cat Trap tournaments between the cats of CatGame.py and
+scripted trappers, played without the GUI across a pool of processes.
+
+Every game starts from an NxN board with the cat in the center and the
+blocks Game.init_random_blocks places for the game's seed, plus a share
+--extra of the tiles blocked at random for harder games. As in the GUI,
+the trapper moves first and the cat answers with Game.CustomCat:
+
+ - the cat wins when it reaches the border,
+ - the trapper wins when the cat can't move (CustomCat returns the cat's
+   own tile).
+
+A cat that runs out of time still moves, with Game.fallback_move. The
+"timeout" column is the share of the cat's moves that did.
+
+Cats:
+    random           Random Cat
+    minimax[:T]      Minimax, with a timeout of T seconds (default 5)
+    alphabeta[:T]    Alpha-Beta, with a timeout of T seconds (default 5)
+    dls:N            Depth-Limited Alpha-Beta to depth N
+    id:T             Iterative Deepening Alpha-Beta with a deadline of T seconds
+    mcts:T           Monte Carlo Tree Search with a deadline of T seconds
+
+Trappers:
+    random           blocks a random free tile
+    neighbour        blocks a random free tile next to the cat
+    greedy           blocks the tile next to the cat that is closest to the border
+
+Usage:
+    python CatTournament.py --cats id:1 dls:3 --trappers greedy --sizes 7 11 --games 500
+
+Each finished game is appended to the --out JSONL file as it comes in, and
+a summary table is printed at the end.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import random
+import time
+
+from CatBoard import EscapeMap
+from CatGame import Game, ij_to_hex
+
+
+def parse_cat(name):
+    """Return the CustomCat arguments of a cat: (randcat, ab, DLS,
+    max_depth, ID, alotted_time) and a dict of the keyword arguments.
+    """
+    kind, _, arg = name.partition(":")
+    if kind == "random":
+        return (True, False, False, 0, False, 5.0), {}
+    if kind == "minimax":
+        return (False, False, False, 0, False, float(arg or 5)), {}
+    if kind == "alphabeta":
+        return (False, True, False, 0, False, float(arg or 5)), {}
+    if kind == "dls" and arg:
+        return (False, True, True, int(arg), False, 3600.0), {}
+    if kind == "id" and arg:
+        return (False, True, False, 0, True, float(arg)), {}
+    if kind == "mcts" and arg:
+        return (False, False, False, 0, False, float(arg)), {"mcts": True}
+    raise ValueError("Unknown cat: %s" % name)
+
+
+def trapper_move(kind, game, rand):
+    """Return the cell the trapper blocks."""
+    position = game.position
+    free = [cell for cell in range(game.size**2) if position.is_free(cell)]
+    near = [cell for cell in position.geometry.adjacent[position.cat] if position.is_free(cell)]
+    if kind == "random" or not near:
+        return rand.choice(free)
+    if kind == "neighbour":
+        return rand.choice(near)
+    if kind == "greedy":
+        # a map of its own: one from track_escape would slow down the cat's search
+        dist = EscapeMap(position).dist
+        best = min(dist[cell] for cell in near)
+        return rand.choice([cell for cell in near if dist[cell] == best])
+    raise ValueError("Unknown trapper: %s" % kind)
+
+
+def play(spec):
+    """Play one game. spec is a dict with cat, trapper, size, seed and extra."""
+    cat, trapper, size, seed = spec["cat"], spec["trapper"], spec["size"], spec["seed"]
+    args, options = parse_cat(cat)
+    rand = random.Random(seed)
+    random.seed(seed)       # for init_random_blocks and the Random Cat
+
+    game = Game(size)
+    game.init_random_blocks(ij_to_hex(size//2, size//2))
+    free = [cell for cell in range(size**2) if game.position.is_free(cell)]
+    for cell in rand.sample(free, round(spec.get("extra", 0) * size**2)):
+        game.position.block(cell)
+    move_times = []
+    depths = []
+    timeouts = 0
+    result = None
+    with contextlib.redirect_stdout(io.StringIO()):  # the cats print a lot
+        while result is None:
+            cell = trapper_move(trapper, game, rand)
+            game.place_block(cell // size, cell % size)
+            if game.position.cat_on_border():
+                result = "cat"
+                break
+
+            start = time.time()
+            new_i, new_j = game.CustomCat(*args, **options)
+            move_times.append(time.time() - start)
+            timeouts += game.fell_back
+            if args[4]:
+                depths.append(game.depth_reached)
+
+            if [new_i, new_j] == [game.cat_i, game.cat_j]:
+                result = "trapper"
+            else:
+                game.place_cat(new_i, new_j)
+
+    record = dict(spec)
+    record.update(winner=result,
+                  timeouts=timeouts,
+                  moves=len(move_times),
+                  move_times=[round(t, 6) for t in move_times],
+                  depths=depths)
+    return record
+
+
+def summarize(records):
+    groups = {}
+    for record in records:
+        groups.setdefault((record["cat"], record["trapper"], record["size"]), []).append(record)
+
+    print("%-14s %-10s %5s %6s %8s %8s %10s %10s %7s" % (
+          "cat", "trapper", "size", "games", "cat win", "timeout", "avg move", "max move", "depth"))
+    for (cat, trapper, size), group in sorted(groups.items()):
+        times = [t for record in group for t in record["move_times"]]
+        depths = [d for record in group for d in record["depths"]]
+        wins = sum(record["winner"] == "cat" for record in group)
+        timeouts = sum(record["timeouts"] for record in group)
+        print("%-14s %-10s %5d %6d %7.1f%% %7.1f%% %8.1fms %8.1fms %7s" % (
+              cat, trapper, size, len(group),
+              100.0 * wins / len(group), 100.0 * timeouts / max(len(times), 1),
+              1000 * sum(times) / max(len(times), 1), 1000 * max(times, default=0),
+              "%.2f" % (sum(depths) / len(depths)) if depths else "-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Cat Trap tournaments")
+    parser.add_argument("--cats", nargs="+", default=["id:1"], help="cats to play (default id:1)")
+    parser.add_argument("--trappers", nargs="+", default=["greedy"],
+                        choices=["random", "neighbour", "greedy"], help="trappers to play against")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[7], help="board sizes (default 7)")
+    parser.add_argument("--games", type=int, default=100, help="games per cat, trapper and size")
+    parser.add_argument("--extra", type=float, default=0.0,
+                        help="share of the tiles to block on top of the usual ones (default 0)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--out", default="tournament.jsonl", help="JSONL file the games are appended to")
+    args = parser.parse_args()
+
+    for cat in args.cats:
+        parse_cat(cat)
+
+    # the same seeds for every cat and trapper, so they all face the same boards
+    specs = [dict(cat=cat, trapper=trapper, size=size, seed=args.seed + k, extra=args.extra)
+             for cat in args.cats for trapper in args.trappers
+             for size in args.sizes for k in range(args.games)]
+
+    records = []
+    with open(args.out, "a") as out, multiprocessing.Pool(args.processes) as pool:
+        for record in pool.imap_unordered(play, specs):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            records.append(record)
+    summarize(records)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,9 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import  QFont
 
 import math
-from threading import Thread, Event
+import time
+
+import numpy as np
 
 from CatGame import *
 from hexutil import *
@@ -67,7 +69,14 @@ class Level(object):
 
 
 class GameWidget(QtWidgets.QWidget):
-    """The Qt Widget which shows the game."""
+    """The Qt Widget which shows the game.
+
+    The board is painted once into a QPixmap, self.board, and paintEvent
+    copies the part of it that needs repainting and draws the hover
+    highlight on top. When tiles change, invalidate repaints just them
+    in the pixmap and asks for just their part of the widget (update with
+    a QRegion). The polygons of the tiles are computed once per board.
+    """
 
     _tile_brushes = {
             '.' : QtGui.QBrush(QtGui.QColor("yellow")),
@@ -87,6 +96,8 @@ class GameWidget(QtWidgets.QWidget):
         self.level = Level(self.dim)
         self.center = ij_to_hex(self.dim//2,self.dim//2)
         self.hexgrid = hexutil.HexGrid(TileRes)
+        self.worker = None      # the CatWorker while the cat is thinking
+        self.board = None       # the QPixmap of the board, painted by paint_board
         self.restart()
 
         # initialize GUI objects needed for painting
@@ -98,48 +109,108 @@ class GameWidget(QtWidgets.QWidget):
         self.unseen_brush = QtGui.QBrush(QtGui.QColor(0, 0, 0, 127))
         self.block_brush = QtGui.QBrush(QtGui.QColor("Gray"))
         self.cat_brush = QtGui.QBrush(QtGui.QColor("Orange"))
+        self.cat_font = QFont("Courier", 8, QFont.Bold)
         self.update_fov()
+        self.build_tiles()
         self.edit_mode=False
 
     def restart(self):
-        self.cat = self.center
         self.game = Game(self.dim)
-        self.blocks=[]
-        
-        self.game.init_random_blocks(self.cat)
-        self.backannotate()
-        self.repaint()
+        self.game.init_random_blocks(self.center)
+        self.board = None
+        self.update()
 
+    # The board is only kept in self.game: the widget reads the blocks and
+    # the cat from it, and changes them through its place_/remove_ methods.
 
-    def backannotate(self):
-        self.cat = ij_to_hex(self.game.cat_i,self.game.cat_j)
-        
-        for i in range(self.game.size):
-          for j in range(self.game.size):
-              if self.game.tiles[i][j]==1:
-                self.blocks.append(ij_to_hex(i,j))
+    @property
+    def cat(self):
+        """The cat's hexagon, (-1,-1) when there is no cat."""
+        return ij_to_hex(self.game.cat_i,self.game.cat_j)
+
+    def is_blocked(self, hexagon):
+        hex_i, hex_j = hex_to_ij(hexagon)
+        return 0<=hex_i<self.dim and 0<=hex_j<self.dim and self.game.is_blocked(hex_i,hex_j)
     
     def setEditMode(self,state):
         self.edit_mode=state
 
     def update_fov(self):
-        self.fov = self.center.field_of_view(transparent=self.level.is_transparent, max_distance=100)
+        # the board as a grid of Hex(x, y), transparent[y, x], for field_of_view_grid
+        transparent = np.zeros((self.dim, 2*self.dim), bool)
+        for hexagon in self.level.tiles:
+            transparent[hexagon.y, hexagon.x] = self.level.is_transparent(hexagon)
+        visible = self.center.field_of_view_grid(transparent, max_distance=self.dim)
+        ys, xs = np.nonzero(visible)
+        self.fov = dict(zip(map(Hex, xs.tolist(), ys.tolist()), visible[ys, xs].tolist()))
         self.level.update_fov(self.fov)
 
-    def hexagon_of_pos(self, pos):
-        """Compute the hexagon at the screen position."""
+    def build_tiles(self):
+        """Compute the polygon and the text box of every tile in view, with
+        the origin at the center of the widget.
+        """
+        hexagons = sorted((hexagon for hexagon in self.level.seen_tiles
+                           if self.level.get_seen_tile(hexagon) not in ' #'),
+                          key=lambda hexagon: (hexagon.y, hexagon.x))
+        offsets = np.array(hexagons, int).reshape(-1, 2) - self.center
+        corners = self.hexgrid.corners_of(offsets).reshape(-1, 12).tolist()    # x1, y1, x2, y2, ...
+        boxes = self.hexgrid.bounding_boxes(offsets).tolist()
+        self.polygons = {}
+        self.text_rects = {}
+        for hexagon, points, box in zip(hexagons, corners, boxes):
+            self.polygons[hexagon] = QtGui.QPolygon(points)
+            self.text_rects[hexagon] = QtCore.QRectF(*box)
+
+    def origin(self):
+        """The center of the widget, where the center tile is."""
         size = self.size()
+        return QtCore.QPoint(size.width()//2, size.height()//2)
+
+    def tile_rect(self, hexagon):
+        """The part of the widget a tile covers, outline included."""
+        margin = self.pen.width()
+        rect = self.polygons[hexagon].boundingRect().translated(self.origin())
+        return rect.adjusted(-margin, -margin, margin, margin)
+
+    def invalidate(self, *hexagons):
+        """Repaint tiles that changed in self.board, and on the screen."""
+        hexagons = [hexagon for hexagon in hexagons if hexagon in self.polygons]
+        if self.board is None or not hexagons:
+            self.update()
+            return
+        region = QtGui.QRegion()
+        for hexagon in hexagons:
+            region += self.tile_rect(hexagon)
+        # The outlines overlap the neighbours, so the neighbours are
+        # painted again too, clipped to the region.
+        painter = QtGui.QPainter()
+        painter.begin(self.board)
+        try:
+            painter.setClipRegion(region)
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+            painter.fillRect(self.rect(), QtCore.Qt.transparent)
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+            self.paint_background(painter)
+            near = set(hexagons)
+            for hexagon in hexagons:
+                near.update(hexagon.neighbours())
+            self.paint_tiles(painter, [hexagon for hexagon in self.polygons if hexagon in near])
+        finally:
+            painter.end()
+        self.update(region)
 
-        dx=TileRes+8
-        dy=TileRes*round(math.sqrt(1.0/3.0))-2
-
-        size = self.size()
-        xc = size.width()//2
-        yc = size.height()//2
+    def resizeEvent(self, event):
+        self.board = None
+        super().resizeEvent(event)
 
-        return self.center + self.hexgrid.hex_at_coordinate(pos.x() - xc, pos.y() - yc)
+    def hexagon_of_pos(self, pos):
+        """Compute the hexagon at the screen position."""
+        origin = self.origin()
+        return self.center + self.hexgrid.hex_at_coordinate(pos.x() - origin.x(), pos.y() - origin.y())
 
     def mousePressEvent(self, event):
+        if self.worker is not None:                 # the cat is thinking
+            return
         hexagon = self.hexagon_of_pos(event.pos())
         if self.edit_mode:
 
@@ -150,32 +221,22 @@ class GameWidget(QtWidgets.QWidget):
                 return
 
             if self.cat==(-1,-1):                   # where to place the cat
-                if hexagon in self.blocks:          
-                    self.blocks.remove(hexagon)
-                self.game.tiles[hex_i][hex_j] = 6  
-                self.game.cat_i = hex_i
-                self.game.cat_j = hex_j
-                self.cat = ij_to_hex(hex_i,hex_j)
+                self.game.place_cat(hex_i,hex_j)    # unblocks the tile too
                 self.mainWidget.editCheckbox.setDisabled(False) 
             else:                                   # which tile to toggle
                 if hexagon == self.cat:
-                    self.game.tiles[hex_i][hex_j] = 0  
-                    self.game.cat_i = -1
-                    self.game.cat_j = -1
-                    self.cat = ij_to_hex(-1,-1)
+                    self.game.remove_cat()
                     self.mainWidget.editCheckbox.setDisabled(True)
 
-                elif hexagon in self.blocks:
-                    self.blocks.remove(hexagon)
-                    self.game.tiles[hex_i][hex_j]=0    
+                elif self.game.is_blocked(hex_i,hex_j):
+                    self.game.remove_block(hex_i,hex_j)
                 else:
-                    self.blocks.append(hexagon)
-                    self.game.tiles[hex_i][hex_j]=1
+                    self.game.place_block(hex_i,hex_j)
 
-            self.repaint()
+            self.invalidate(hexagon)
 
         else:
-            if hexagon == self.cat or hexagon in self.blocks:
+            if hexagon == self.cat or self.is_blocked(hexagon):
                 return
 
             hex_i, hex_j = hex_to_ij(hexagon)
@@ -184,9 +245,7 @@ class GameWidget(QtWidgets.QWidget):
                hex_i<0    or hex_j<0:
                 return
             
-            self.blocks.append(hexagon)
-            
-            self.game.tiles[hex_i][hex_j]=1
+            self.game.place_block(hex_i,hex_j)
             self.game.print_tiles()
               
 
@@ -198,10 +257,9 @@ class GameWidget(QtWidgets.QWidget):
                 msgBox.setText("The Cat Won... of course.")
                 msgBox.exec()
                 self.restart()
-                self.repaint()
                 return
         
-            self.repaint()
+            self.invalidate(hexagon)
 
             randcat = True if self.mainWidget.RCcheckbox.isChecked() else False
             ab = True if self.mainWidget.ABcheckbox.isChecked() else False
@@ -210,27 +268,52 @@ class GameWidget(QtWidgets.QWidget):
             ID = True if self.mainWidget.IDcheckbox.isChecked() else False
             alotted_time = float(self.mainWidget.timeText.text())
 
-            newI,newJ = self.game.CustomCat(randcat,ab,DLS,max_depth,ID,alotted_time)
-            
-            print ("New cat coordinates:",newI,newJ)
-            newHex=ij_to_hex(newI,newJ)
+            self.start_cat((randcat,ab,DLS,max_depth,ID,alotted_time))
+
+    def start_cat(self, args):
+        """Let the cat think in a CatWorker. cat_moved gets its move."""
+        self.worker = CatWorker(self.game, args)
+        self.worker.depthFinished.connect(self.mainWidget.catProgress)
+        self.worker.moveFound.connect(self.cat_moved)
+        self.mainWidget.catStarted(args[5])
+        self.worker.start()
+
+    def cancel_cat(self):
+        """Stop the cat's search, if any, and forget about its move."""
+        if self.worker is not None:
+            self.worker.moveFound.disconnect()
+            self.worker.depthFinished.disconnect()
+            self.worker.cancel()
+            self.worker.wait()
+            self.worker = None
+            self.mainWidget.catStopped()
+
+    def cat_moved(self, move):
+        self.worker.wait()
+        self.game.stats = self.worker.game.stats
+        self.game.depth_reached = self.worker.game.depth_reached
+        self.worker = None
+        self.mainWidget.catStopped()
+
+        newI,newJ = move
+        print ("New cat coordinates:",newI,newJ)
+        newHex=ij_to_hex(newI,newJ)
+        if (newI == -1 and newJ == -1):
+        	print("Time is up! Cat Removed.")
+
+        if self.cat == newHex:
+            msgBox = QMessageBox()
+            msgBox.setWindowTitle("Game Ended")
+            msgBox.setText("       You Won!!!       ")
+            msgBox.exec()
+            self.restart()
+        else:
+            oldHex=self.cat
             if (newI == -1 and newJ == -1):
-            	print("Time is up! Cat Removed.")
-
-            if self.cat == newHex:
-                msgBox = QMessageBox()
-                msgBox.setWindowTitle("Game Ended")
-                msgBox.setText("       You Won!!!       ")
-                msgBox.exec()
-                self.restart()
+                self.game.remove_cat()
             else:
-                self.game.tiles[cat_i][cat_j]=0
-                self.cat=newHex
-                self.game.tiles[newI][newJ]=6
-                self.game.cat_i=newI
-                self.game.cat_j=newJ
-                
-            self.repaint()
+                self.game.place_cat(newI,newJ)
+            self.invalidate(oldHex, newHex)
 
 
     def mouseMoveEvent(self, event):
@@ -242,88 +325,110 @@ class GameWidget(QtWidgets.QWidget):
         
 
         if hexagon != self.selected_hexagon:
+            region = QtGui.QRegion()
+            for tile in (self.selected_hexagon, hexagon):
+                if tile in self.polygons:
+                    region += self.tile_rect(tile)
             self.selected_hexagon = hexagon
-            self.repaint()
+            if not region.isEmpty():
+                self.update(region)
  
-    def paintEvent(self, event):
-        # compute center of window
+    def paint_board(self):
+        """Paint the whole board into self.board."""
+        ratio = self.devicePixelRatioF()
+        self.board = QtGui.QPixmap(self.size() * ratio)
+        self.board.setDevicePixelRatio(ratio)
+        self.board.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter()
+        painter.begin(self.board)
+        try:
+            self.paint_background(painter)
+            self.paint_tiles(painter, self.polygons)
+        finally:
+            painter.end()
+
+    def paint_background(self, painter):
+        # paint background black
         dx=TileRes+8
         dy=TileRes*round(math.sqrt(1.0/3.0))-2
 
-        size = self.size()
-        xc = size.width()//2
-        yc = size.height()//2
-
-        # bounding box when we translate the origin to be at the center
-        bbox = hexutil.Rectangle(-xc, -yc, 2*xc, 2*yc)
+        origin = self.origin()
+        xc, yc = origin.x(), origin.y()
+        painter.save()
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setBrush(QtGui.QColor("darkGray"))
+        painter.drawRect(xc-self.dim*dx, yc-self.dim*dy, self.dim*dx*2, self.dim*dy*2)
+        painter.restore()
+
+    def paint_tiles(self, painter, hexagons):
+        """Paint tiles with their blocks and the cat, on the background."""
+        painter.save()
+        painter.setPen(self.pen)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setRenderHint(QtGui.QPainter.TextAntialiasing)
+        painter.setFont(self.cat_font)
+        painter.translate(self.origin())
+        cat = self.cat
+        for hexagon in hexagons:
+            polygon = self.polygons[hexagon]
+            painter.setBrush(self._tile_brushes[self.level.get_seen_tile(hexagon)])
+            painter.drawPolygon(polygon)
+
+            if self.is_blocked(hexagon):
+                painter.setBrush(self.block_brush)
+                painter.drawPolygon(polygon)
+                
+            if hexagon == cat:
+                painter.setBrush(self.cat_brush)
+                painter.drawPolygon(polygon)
+                painter.drawText(self.text_rects[hexagon], QtCore.Qt.AlignCenter, "/\\ /\\\n(=`I´=)")
+                #
+                #  /\ /\
+                # (>`ェ´<)  ASCII Art Cat!
+                # 
+        painter.restore()
 
-        hexgrid = self.hexgrid
+    def paintEvent(self, event):
+        if self.board is None:
+            self.paint_board()
         painter = QtGui.QPainter()
         painter.begin(self)
         try:
-            # paint background black
-            painter.save()
-            painter.setPen(QtCore.Qt.NoPen)
-            painter.setBrush(QtGui.QColor("darkGray"))
-
-            painter.drawRect(xc-self.dim*dx, yc-self.dim*dy, self.dim*dx*2, self.dim*dy*2)
-            painter.restore()
-
-            # set up drawing state
-            painter.setPen(self.pen)
-            painter.setRenderHint(QtGui.QPainter.Antialiasing)
-            painter.setRenderHint(QtGui.QPainter.TextAntialiasing)
-            painter.setFont(QFont("Courier", 8, QFont.Bold))
-            painter.translate(xc, yc)
-            # draw each hexagon which is in the window
-            for hexagon in hexgrid.hexes_in_rectangle(bbox):
-                polygon = QtGui.QPolygon([QtCore.QPoint(*corner) for corner in hexgrid.corners(hexagon)])
-                hexagon2 = hexagon + self.center
-                tile = self.level.get_seen_tile(hexagon2)
-                if tile == ' ' or tile=='#':
-                    continue
-                painter.setBrush(self._tile_brushes[tile])
-                painter.drawPolygon(polygon)
-
-                if hexagon2 == self.selected_hexagon:
-                    painter.setBrush(self.select_brush)
-                    painter.drawPolygon(polygon)
-                if hexagon2 in self.blocks:
-                    painter.setBrush(self.block_brush)
-                    painter.drawPolygon(polygon)
-                    
-                if hexagon2 == self.cat:
-                    painter.setBrush(self.cat_brush)
-                    rect = hexgrid.bounding_box(hexagon)
-                    painter.drawPolygon(polygon)
-                    rect = QtCore.QRectF(*rect) # convert to Qt RectF
-                    painter.drawText(rect, QtCore.Qt.AlignCenter, "/\\ /\\\n(=`I´=)")
-                    #
-                    #  /\ /\
-                    # (>`ェ´<)  ASCII Art Cat!
-                    # 
-
+            # Qt clips this to the region to repaint
+            painter.drawPixmap(0, 0, self.board)
+
+            # the highlight of the tile under the mouse, unless a block
+            # or the cat covers it
+            hexagon = self.selected_hexagon
+            if hexagon in self.polygons and hexagon != self.cat and not self.is_blocked(hexagon):
+                painter.setPen(self.pen)
+                painter.setRenderHint(QtGui.QPainter.Antialiasing)
+                painter.setBrush(self.select_brush)
+                painter.translate(self.origin())
+                painter.drawPolygon(self.polygons[hexagon])
         finally:
             painter.end()
 
-class MyTimer(Thread):
-    def __init__(self, event, mainWidget, game):
-        Thread.__init__(self)
-        self.stopped = event
+class CatWorker(QThread):
+    """Runs Game.CustomCat off the GUI thread, on a copy of the game
+    (Game.search_copy) so that the board can be painted meanwhile.
+    depthFinished is emitted with the depth and the best move so far each
+    time Iterative Deepening finishes a depth, moveFound with the move.
+    """
+    depthFinished = pyqtSignal(int, object)
+    moveFound = pyqtSignal(object)
 
-        self.start_time = time.time()
-        self.deadline = self.start_time + mainWidget.cat_trap.alotted_time
-        self.mainWidget=mainWidget
+    def __init__(self, game, args):
+        super().__init__()
+        self.game = game.search_copy()
+        self.game.on_progress = self.depthFinished.emit
+        self.args = args
 
+    def run(self):
+        self.moveFound.emit(self.game.CustomCat(*self.args))
 
-    def run(self,):
-        while not self.stopped.wait(0.01):
-            print("my thread")
-            self.mainWidget.timeLeftLabel.setText(str('%.1f' % (self.deadline-time.time())))
-            self.mainWidget.repaint()
-            print(str('%.1f' % (self.deadline-time.time())))
-        elapsed_time = (time.time() - self.start_time) * 1000
-        print ("Elapsed time: %.3fms " % elapsed_time)
+    def cancel(self):
+        self.game.cancel()
 
 
 class MyWidget(QWidget):
@@ -367,6 +472,13 @@ class MyWidget(QWidget):
         self.timeText = QLineEdit("5")
         self.timeText.setFixedSize(100,height)
 
+        self.timeLeftLabel = QLabel(" ")
+        self.timeLeftLabel.setFixedSize(200,2*height)
+
+        self.countdown = QTimer(self)          # updates timeLeftLabel while the cat thinks
+        self.countdown.setInterval(100)
+        self.countdown.timeout.connect(self.updateCountdown)
+
         self.RCcheckbox = QCheckBox("Random Cat")
         self.RCcheckbox.stateChanged.connect(self.updateRCcheckbox)
         self.RCcheckbox.setFixedWidth(200)
@@ -426,6 +538,7 @@ class MyWidget(QWidget):
         self.rightLayout.addWidget(self.dimText)
         self.rightLayout.addWidget(self.timeLabel)
         self.rightLayout.addWidget(self.timeText)
+        self.rightLayout.addWidget(self.timeLeftLabel)
         self.rightLayout.addWidget(self.spaceLabel1)        
         self.rightLayout.addWidget(QHLine())
         self.rightLayout.addWidget(self.spaceLabel1)
@@ -496,11 +609,38 @@ class MyWidget(QWidget):
         else:
             self.cat_trap.setEditMode(False)
 
+    def catStarted(self, alotted_time):
+        self.cat_deadline = time.time() + alotted_time
+        self.cat_depth = 0
+        self.cat_best = None
+        self.updateCountdown()
+        self.countdown.start()
+
+    def catProgress(self, depth, move):
+        self.cat_depth = depth
+        self.cat_best = move
+        self.updateCountdown()
+
+    def catStopped(self):
+        self.countdown.stop()
+        self.timeLeftLabel.setText(" ")
+
+    def updateCountdown(self):
+        text = "Cat thinking: %.1fs left" % max(self.cat_deadline - time.time(), 0)
+        if self.cat_best is not None:
+            text += "\nDepth %d, best move %s" % (self.cat_depth, self.cat_best)
+        self.timeLeftLabel.setText(text)
+
+    def closeEvent(self, event):
+        self.cat_trap.cancel_cat()
+        super().closeEvent(event)
+
     @pyqtSlot()
     def on_click(self):
         print('New Game Started')
         print("Hexgrid dimensions:",self.dimText.text(),"x",self.dimText.text())
 
+        self.cat_trap.cancel_cat()
         self.leftLayout.removeWidget(self.cat_trap)
         self.cat_trap.deleteLater()
         self.cat_trap = None
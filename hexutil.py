@@ -12,9 +12,13 @@ import operator
 import math
 import random
 
+import numpy as np
+
 class InvalidHex(ValueError):
     pass
 
+_tuple_new = tuple.__new__
+
 class Hex(namedtuple("Hex", "x y")):
     "A single hexagon in a hexagonal grid."""
     _neighbours = ((2, 0), (1, 1), (-1, 1), (-2, 0), (-1, -1), (1, -1))
@@ -25,52 +29,55 @@ class Hex(namedtuple("Hex", "x y")):
             raise InvalidHex("x and y coordinate must sum to an even number")
         return super().__new__(cls, x, y)
 
+    # The methods below build their results with _hex, which skips the
+    # check: a valid hex plus, minus or turned by another one is valid.
+
     def neighbours(self):
         """Return the 6 direct neighbours of this hex."""
         x, y = self
-        return [Hex(x+dx, y+dy) for dx, dy in self._neighbours]
+        return [_hex(x+dx, y+dy) for dx, dy in self._neighbours]
 
     def random_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = random.choice(self._neighbours)
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     def right_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[0]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     def down_right_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[1]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     def down_left_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[2]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     def left_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[3]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     def up_left_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[4]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
     
     def up_right_neighbour(self, random=random):
         """Return a random neighbour of this hexagon."""
         x, y = self
         dx, dy = self._neighbours[5]
-        return Hex(x+dx, y+dy)
+        return _hex(x+dx, y+dy)
 
     
     def random_walk(self, N, random=random):
@@ -111,16 +118,16 @@ class Hex(namedtuple("Hex", "x y")):
     def __add__(self, other):
         x1, y1 = self
         x2, y2 = other
-        return Hex(x1+x2, y1+y2)
+        return _hex(x1+x2, y1+y2)
 
     def __sub__(self, other):
         x1, y1 = self
         x2, y2 = other
-        return Hex(x1-x2, y1-y2)
+        return _hex(x1-x2, y1-y2)
 
     def __neg__(self):
         x, y = self
-        return Hex(-x, -y)
+        return _hex(-x, -y)
 
     def distance(self, other):
         """Distance in number of hexagon steps.
@@ -136,13 +143,13 @@ class Hex(namedtuple("Hex", "x y")):
         """Given a hex return the hex when rotated 60° counter-clock-wise around the origin.
         """
         x, y = self
-        return Hex((x - 3 * y) >> 1, (x + y) >> 1)
+        return _hex((x - 3 * y) >> 1, (x + y) >> 1)
 
     def rotate_right(self):
         """Given a hex return the hex when rotated 60° clock-wise around the origin.
         """
         x, y = self
-        return Hex((x + 3 * y) >> 1, (y - x) >> 1)
+        return _hex((x + 3 * y) >> 1, (y - x) >> 1)
 
     def field_of_view(self, transparent, max_distance, visible=None):
         """Calculate field-of-view.
@@ -164,10 +171,35 @@ class Hex(namedtuple("Hex", "x y")):
         if visible is None:
             visible = {}
         visible[self] = all_directions
+        table = fov_table(max_distance)
+        first_child = table.children()
         for direction in range(6):
-            _fovtree._field_of_view(self, direction, transparent, max_distance, visible)
+            hexagons, sides = table.hexagons(direction)
+            nodes = range(table.roots)
+            while nodes:
+                behind = []
+                for node in nodes:
+                    hexagon = self + hexagons[node]
+                    if transparent(hexagon):
+                        visible[hexagon] = all_directions
+                        behind.extend(range(first_child[node], first_child[node+1]))
+                    else:
+                        visible[hexagon] = sides[node] | visible.get(hexagon, 0)
+                nodes = behind
         return visible
 
+    def field_of_view_grid(self, transparent, max_distance):
+        """Calculate field-of-view on a grid, all at once with NumPy.
+        transparent  -- 2D boolean array, transparent[y, x] tells if Hex(x, y) is
+                        transparent. Hexagons outside the array are opaque.
+        max_distance -- maximum distance you can view
+
+        Returns an array of the shape of transparent, holding for each
+        hexagon in the array the bitmask field_of_view would give it, or 0
+        if it is not visible.
+        """
+        return fov_table(max_distance).run(transparent, self)
+
     def find_path(self, destination, passable, cost=lambda pos: 1):
         """Perform path-finding.
         self        -- Starting position for path finding.
@@ -180,6 +212,10 @@ class Hex(namedtuple("Hex", "x y")):
         return pathfinder.path
 
 
+def _hex(x, y):
+    """Hex(x, y) without the parity check, for coordinates known to be valid."""
+    return _tuple_new(Hex, (x, y))
+
 all_directions = (1 << 6) - 1
 origin = Hex(0, 0)
 
@@ -192,53 +228,131 @@ Hex.rotations = (
         operator.methodcaller("rotate_right")
         )
 
-class _FovTree:
+class FovTable:
+    """The shadow-casting tree of field_of_view, down to max_distance, as
+    flat arrays. Get these from fov_table(max_distance), which caches them.
+
+    The tree covers the 60° sector east of the viewer. A node is a hexagon
+    seen through a window between two angles, and its children are the
+    hexagons right behind it that are still seen through that window. The
+    nodes are in breadth-first order: nodes 0 to roots-1 are the roots,
+    and the children of node i are nodes first_child[i] to
+    first_child[i+1]-1. The hexagons are stored turned into each of the
+    6 sectors:
+
+    x[direction], y[direction] -- the hexagon of each node, from the viewer
+    sides[direction]           -- the bitmask of the side it is seen from
+    parent                     -- the parent of each node, -1 for the roots
+    levels                     -- (start, end) of the nodes of each depth
+    """
     _corners = ((0, -2), (1, -1), (1, 1), (0, 2))
-    _neighbours = (Hex(1, -1), Hex(2, 0), Hex(1, 1))
-    _cached_successors = None
-
-    def __init__(self, hexagon, direction, angle1, angle2):
-        self.hexagon = hexagon
-        self.angle1 = angle1
-        self.angle2 = angle2
-        self.direction = direction
-        self.hexagons = [rot(hexagon) for rot in Hex.rotations]
-        self.distance = hexagon.distance(origin)
-
-    def get_angle(self, corner):
-        cx, cy = corner
-        x, y = self.hexagon
-        return (3*y + cy)/float(x + cx)
-
-    def _field_of_view(self, offset, direction, transparent, max_distance, visible):
-        if self.distance > max_distance:
-            return
-        hexagon = offset + self.hexagons[direction]
-        if transparent(hexagon):
-            visible[hexagon] = all_directions
-            for succ in self.successors():
-                succ._field_of_view(offset, direction, transparent, max_distance, visible)
-        else:
-            directions = 1 << ((self.direction + direction) % 6)
-            visible[hexagon] = directions | visible.get(hexagon, 0)
-
-    def successors(self):
-        _cached_successors = self._cached_successors
-        if _cached_successors is None:
-            _cached_successors = []
-            angles = [self.get_angle(c) for c in self._corners]
-            hexagon = self.hexagon
-            for i in range(3):
-                c1 = max(self.angle1, angles[i])
-                c2 = min(self.angle2, angles[i+1])
-                if c1 < c2:
-                    nb = self._neighbours[i]
-                    _cached_successors.append(_FovTree(hexagon + nb, (i-1) % 6, c1, c2))
-            self._cached_successors = _cached_successors
-
-        return _cached_successors
-
-_fovtree = _FovTree(Hex(2, 0), 0, -1.0, 1.0)
+    _neighbours = ((1, -1), (2, 0), (1, 1))
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        # the root, Hex(2, 0), sees the whole sector
+        count = 1 if max_distance >= 1 else 0
+        x = np.full(count, 2)
+        y = np.zeros(count, int)
+        angle1 = np.full(count, -1.0)
+        angle2 = np.full(count, 1.0)
+        direction = np.zeros(count, int)
+        parent = np.full(count, -1)
+        xs, ys, directions, parents = [], [], [], []
+        self.levels = []
+        start = 0
+        while len(x):
+            end = start + len(x)
+            self.levels.append((start, end))
+            xs.append(x)
+            ys.append(y)
+            directions.append(direction)
+            parents.append(parent)
+
+            # Each child's window is the part of the parent's between two of
+            # the parent's corners. The children come in order of parent,
+            # then of corner.
+            angles = [(3*y + cy) / (x + cx) for cx, cy in self._corners]
+            c1 = np.stack([np.maximum(angle1, angles[i]) for i in range(3)], axis=1)
+            c2 = np.stack([np.minimum(angle2, angles[i+1]) for i in range(3)], axis=1)
+            cx = np.stack([x + dx for dx, dy in self._neighbours], axis=1)
+            cy = np.stack([y + dy for dx, dy in self._neighbours], axis=1)
+            distance = np.abs(cy) + np.maximum(0, (np.abs(cx) - np.abs(cy)) // 2)
+            keep = (c1 < c2) & (distance <= max_distance)
+            x, y, angle1, angle2 = cx[keep], cy[keep], c1[keep], c2[keep]
+            direction = np.broadcast_to([5, 0, 1], keep.shape)[keep]
+            parent = np.broadcast_to(np.arange(start, end)[:, None], keep.shape)[keep]
+            start = end
+
+        x = np.concatenate(xs) if xs else np.zeros(0, int)
+        y = np.concatenate(ys) if ys else np.zeros(0, int)
+        direction = np.concatenate(directions) if directions else np.zeros(0, int)
+        self.parent = np.concatenate(parents) if parents else np.zeros(0, int)
+        self.roots = count
+        self.first_child = np.searchsorted(self.parent, np.arange(len(x)+1))
+        # the same turns as Hex.rotations
+        self.x = np.empty((6, len(x)), int)
+        self.y = np.empty((6, len(x)), int)
+        for d, (tx, ty) in enumerate(((x, y),
+                                      ((x - 3*y) >> 1, (x + y) >> 1),
+                                      (-((x + 3*y) >> 1), -((y - x) >> 1)),
+                                      (-x, -y),
+                                      (-((x - 3*y) >> 1), -((x + y) >> 1)),
+                                      ((x + 3*y) >> 1, (y - x) >> 1))):
+            self.x[d] = tx
+            self.y[d] = ty
+        self.sides = (1 << ((direction + np.arange(6)[:, None]) % 6)).astype(np.uint8)
+        self._lists = {}
+
+    def hexagons(self, direction):
+        """The hexagons and sides of direction as lists, for field_of_view."""
+        if direction not in self._lists:
+            self._lists[direction] = ([_hex(x, y) for x, y in zip(self.x[direction].tolist(), self.y[direction].tolist())],
+                                      self.sides[direction].tolist())
+        return self._lists[direction]
+
+    def children(self):
+        """first_child as a list, for field_of_view."""
+        if "children" not in self._lists:
+            self._lists["children"] = self.first_child.tolist()
+        return self._lists["children"]
+
+    def run(self, transparent, viewer):
+        """See Hex.field_of_view_grid."""
+        height, width = transparent.shape
+        x = self.x + viewer.x
+        y = self.y + viewer.y
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        clear = np.zeros(x.shape, bool)
+        clear[inside] = transparent[y[inside], x[inside]]
+        # a node is looked at when its parent is, and is transparent
+        seen = np.zeros(x.shape, bool)
+        for start, end in self.levels:
+            if start == 0:
+                seen[:, :end] = True
+            else:
+                parent = self.parent[start:end]
+                seen[:, start:end] = seen[:, parent] & clear[:, parent]
+        seen &= inside
+
+        visible = np.zeros(transparent.shape, np.uint8)
+        wall = seen & ~clear
+        np.bitwise_or.at(visible, (y[wall], x[wall]), self.sides[wall])
+        seen &= clear
+        visible[y[seen], x[seen]] = all_directions
+        if 0 <= viewer.x < width and 0 <= viewer.y < height:
+            visible[viewer.y, viewer.x] = all_directions
+        return visible
+
+
+_fov_tables = {}
+
+def fov_table(max_distance):
+    """Return the (cached) FovTable for max_distance."""
+    table = _fov_tables.get(max_distance)
+    if table is None:
+        table = _fov_tables[max_distance] = FovTable(max_distance)
+    return table
 
 class Rectangle(namedtuple("Rectangle", "x y width height")):
     """Represents a rectangle.
@@ -306,13 +420,13 @@ class HexGrid(namedtuple("HexGrid", "width height")):
 
         if (x0 + y0) % 2 == 0:
             if width * δy < height * (2 * width - δx):
-                return Hex(x0, y0)
+                return _hex(x0, y0)
             else:
-                return Hex(x0 + 1, y0 + 1)
+                return _hex(x0 + 1, y0 + 1)
         elif width * δy < height * (width + δx):
-            return Hex(x0 + 1, y0)
+            return _hex(x0 + 1, y0)
         else:
-            return Hex(x0, y0 + 1)
+            return _hex(x0, y0 + 1)
 
     def hexes_in_rectangle(self, rectangle):
         """Return a sequence with the hex coordinates in the rectangle."""
@@ -320,4 +434,40 @@ class HexGrid(namedtuple("HexGrid", "width height")):
         width, height = self
         x_range = _make_range(rx, r_width, width, width)
         y_range = _make_range(ry, r_height, 2*height, 3*height)
-        return (Hex(x, y) for y in y_range for x in x_range if (x + y) % 2 == 0)
+        return (_hex(x, y) for y in y_range for x in x_range if (x + y) % 2 == 0)
+
+    # The same for many hexagons at once, with NumPy. hexes is an (n, 2)
+    # array of x, y coordinates, or anything numpy.asarray turns into one,
+    # such as a list of Hex.
+
+    def hex_array_in_rectangle(self, rectangle):
+        """Return the hexes of hexes_in_rectangle, as an (n, 2) array."""
+        rx, ry, r_width, r_height = rectangle
+        width, height = self
+        x_range = _make_range(rx, r_width, width, width)
+        y_range = _make_range(ry, r_height, 2*height, 3*height)
+        y, x = np.meshgrid(np.arange(y_range.start, y_range.stop),
+                           np.arange(x_range.start, x_range.stop), indexing="ij")
+        even = (x + y) % 2 == 0
+        return np.stack([x[even], y[even]], axis=1)
+
+    def centers_of(self, hexes):
+        """Get the centers of hexes, as an (n, 2) array."""
+        width, height = self
+        return np.asarray(hexes).reshape(-1, 2) * (width, 3*height)
+
+    def corners_of(self, hexes):
+        """Get the 6 corners of each of hexes, as an (n, 6, 2) array."""
+        width, height = self
+        return self.centers_of(hexes)[:, None, :] + np.array(self._corners) * (width, height)
+
+    def bounding_boxes(self, hexes):
+        """Get the bounding boxes of hexes, as an (n, 4) array of Rectangle fields."""
+        width, height = self
+        centers = self.centers_of(hexes)
+        boxes = np.empty((len(centers), 4), centers.dtype)
+        boxes[:, 0] = centers[:, 0] - width
+        boxes[:, 1] = centers[:, 1] - 2*height
+        boxes[:, 2] = 2*width
+        boxes[:, 3] = 4*height
+        return boxes